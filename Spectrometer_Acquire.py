@@ -12,8 +12,157 @@ import time
 from datetime import datetime
 import h5py
 import os
+try:
+    import hdf5plugin
+except ImportError:  # Optional, spectra are compressed with the built-in LZF filter without it
+    hdf5plugin = None
+try:
+    import blosc
+except ImportError:  # Optional, used to compress whole chunks for direct writes
+    blosc = None
 
 import Stage_Interface
+import spec_numba
+
+CHUNK_BYTES = 1024**2  # Target size of HDF5 chunks when saving spectra
+WRITE_QUEUE_CHUNKS = 16  # Chunks of spectra that may wait for the disk before new ones are dropped
+FRAME_INTERVAL = 0.02  # Minimum time between two live plot updates in seconds (50 fps)
+
+# Shuffling followed by a fast codec compresses smooth spectra well at little CPU cost,
+# bit-wise shuffling (Bitshuffle/LZ4 run by Blosc) works best on detector counts
+if hdf5plugin is not None:
+    SPECTRA_COMPRESSION = dict(hdf5plugin.Blosc(cname="lz4", clevel=3, shuffle=hdf5plugin.Blosc.BITSHUFFLE))
+else:
+    SPECTRA_COMPRESSION = dict(compression="lzf", shuffle=True)
+
+# Full chunks can be compressed with the same Blosc settings here and written past the HDF5 filter pipeline
+if hdf5plugin is not None and blosc is not None:
+    def compress_chunk(chunk):
+        return blosc.compress_ptr(chunk.__array_interface__["data"][0], chunk.size, typesize=chunk.itemsize,
+                                  clevel=3, shuffle=blosc.BITSHUFFLE, cname="lz4")
+else:
+    compress_chunk = None
+
+
+def create_spectra_file(file_path, chunk_bytes):
+    '''Create an HDF5 file whose chunk cache holds several chunks of spectra.
+    Chunks are always written completely, so they are evicted first (w0=1).
+    Paged allocation groups the metadata of the growing datasets into whole pages
+    instead of scattering small blocks between the chunks.'''
+    return h5py.File(file_path, "w", rdcc_nbytes=16 * chunk_bytes, rdcc_nslots=10007, rdcc_w0=1.0,
+                     fs_strategy="page", fs_page_size=CHUNK_BYTES)
+
+
+def grow_rows(array, n_rows, capacity):
+    '''Return a larger copy of array holding its first n_rows rows.'''
+    grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[:n_rows] = array[:n_rows]
+    return grown
+
+
+class SpectraWriter:
+    '''Streams spectra into a resizable HDF5 dataset while they are acquired.
+    Spectra are collected in a buffer of one chunk, full buffers are handed to a writer thread,
+    so every write to the file is chunk-aligned and a slow disk never blocks the acquisition.'''
+    
+    def __init__(self, file_path, wavelengths, attrs):
+        self.file_path = file_path
+        self.n_pixels = len(wavelengths)
+        self.rows_per_chunk = max(1, CHUNK_BYTES // (self.n_pixels * np.dtype(np.float32).itemsize))
+        
+        self.file = create_spectra_file(file_path, self.rows_per_chunk * self.n_pixels * 4)
+        # The wavelengths are only a few kB and keep every file self-contained
+        self.file.create_dataset("wavelengths", data=wavelengths)
+        self.file.attrs.update(attrs)
+        self.spectra = self.file.create_dataset("spectra", shape=(0, self.n_pixels), dtype=np.float32,
+                                                maxshape=(None, self.n_pixels),
+                                                chunks=(self.rows_per_chunk, self.n_pixels),
+                                                **SPECTRA_COMPRESSION)
+        self.timestamps = self.file.create_dataset("timestamps", shape=(0,), dtype=np.float64,
+                                                   maxshape=(None,), chunks=(self.rows_per_chunk,))
+        
+        self.spectra_buffer = np.empty((self.rows_per_chunk, self.n_pixels), dtype=np.float32)
+        self.timestamp_buffer = np.empty(self.rows_per_chunk, dtype=np.float64)
+        self.n_buffered = 0
+        self.n_written = 0
+        self.n_dropped = 0
+        self.error = None
+        self.closed = False
+        self.lock = threading.Lock()  # append is called from the acquisition thread
+        
+        self.write_queue = queue.Queue(maxsize=WRITE_QUEUE_CHUNKS)
+        self.write_thread = threading.Thread(target=self._write_loop)
+        self.write_thread.daemon = True
+        self.write_thread.start()
+    
+    def append(self, spectrum, timestamp):
+        '''Add a spectrum, spectra arriving after close() are ignored.'''
+        with self.lock:
+            if self.closed:
+                return
+            self.spectra_buffer[self.n_buffered] = spectrum
+            self.timestamp_buffer[self.n_buffered] = timestamp
+            self.n_buffered += 1
+            if self.n_buffered == self.rows_per_chunk:
+                self._hand_over()
+    
+    def _hand_over(self):
+        # Queue the full buffers for the writer thread and continue in new ones
+        try:
+            self.write_queue.put_nowait((self.spectra_buffer, self.timestamp_buffer))
+        except queue.Full:
+            # The disk can't keep up: keep acquiring and lose this chunk instead
+            self.n_dropped += self.n_buffered
+            print(f"Writing to {self.file_path} falls behind, {self.n_buffered} spectra dropped")
+        else:
+            self.spectra_buffer = np.empty_like(self.spectra_buffer)
+            self.timestamp_buffer = np.empty_like(self.timestamp_buffer)
+        self.n_buffered = 0
+    
+    def _write_loop(self):
+        # Runs in the writer thread until close() queues None
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                return
+            if self.error is None:  # After a failed write the rest is only drained
+                try:
+                    self._write(*item)
+                except Exception as e:
+                    self.error = e
+    
+    def _write(self, spectra, timestamps):
+        # Write a block of spectra to the end of the datasets
+        n_total = self.n_written + len(spectra)
+        self.spectra.resize(n_total, axis=0)
+        if compress_chunk is not None and len(spectra) == self.rows_per_chunk:
+            self.spectra.id.write_direct_chunk((self.n_written, 0), compress_chunk(spectra))
+        else:
+            self.spectra[self.n_written:n_total] = spectra
+        self.timestamps.resize(n_total, axis=0)
+        self.timestamps[self.n_written:n_total] = timestamps
+        self.n_written = n_total
+    
+    def close(self):
+        '''Write the remaining spectra and close the file.
+        Raises the first error of the writer thread, if there was one.'''
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            if self.n_buffered:
+                self.write_queue.put((self.spectra_buffer[:self.n_buffered],
+                                      self.timestamp_buffer[:self.n_buffered]))
+            self.write_queue.put(None)
+        self.write_thread.join()
+        try:
+            if self.n_dropped:
+                self.file.attrs["dropped_spectra"] = self.n_dropped
+        finally:
+            self.file.close()
+        if self.error is not None:
+            raise self.error
+
  
 class SpectrometerApp:
     def __init__(self, root):
@@ -49,36 +198,67 @@ class SpectrometerApp:
                 if answer == "yes":
                     self.spec_type = "DEMO"
                     self.demo_integration_time = 100
+                    self.rng = np.random.default_rng()
                 else:
                     self.root.destroy()
                     return
 
+        self.integration_time_ms = 100
+        
+        # Driver calls of the detected spectrometer, chosen once instead of on every read
+        self.read_spectrum = {"OCEAN_OPTICS": self.read_ocean_optics,
+                              "AVANTES": self.read_avantes,
+                              "DEMO": self.read_demo}[self.spec_type]
+        self.apply_integration_time = {"OCEAN_OPTICS": self.apply_ocean_optics_integration_time,
+                                       "AVANTES": self.apply_avantes_integration_time,
+                                       "DEMO": self.apply_demo_integration_time}[self.spec_type]
+        
+        # Timestamps are seconds since midnight, taken from the monotonic performance counter
+        # which is anchored to the wall clock at the start of each acquisition
+        self.anchor_clock()
+        
         # Background spectrum and subtraction toggle
         self.request_background = False
         self.background_spectrum = None
         self.subtract_background = tk.BooleanVar(value=False)
+        self.background_enabled = False  # Plain copy of the checkbox for the update loop, no Tcl call per frame
         self.frog_mode = False
         
         # Data acquisition toggle
         self.acquiring = False
-        self.acquired_spectra = []
-        self.timestamps = []
+        self.spectra_writer = None
+        self.save_thread = None
+        # Preallocated arrays for FROG scans, filled up to n_acquired
+        self.acquired_spectra = None
+        self.acquired_timestamps = None
+        self.acquired_positions = None
+        self.n_acquired = 0
         self.reference_lines = []  # Store reference lines
         
         # Stage for scans and interface
         self.stage_interface_open = False
+        self.frog_thread = None
         self.stage = None
         self.motor_number = None
+        self.position_cache = None  # Shared with the stage interface once it is opened
 
         # Set up the plot
         if self.spec_type == "OCEAN_OPTICS":
             self.wavelengths = self.spectrometer.wavelengths()
         if self.spec_type == "AVANTES":
-            self.wavelengths = avs.AVS_GetLambda(self.active_spec_handle)
+            self.wavelengths = avs.get_active_wavelengths(self.active_spec_handle)
         if self.spec_type == "DEMO":
             self.wavelengths = np.arange(1000)
+        # Same contiguous double array for every spectrometer, converted once for plotting and saving
+        self.wavelengths = np.ascontiguousarray(self.wavelengths, dtype=np.float64)
+        # Region of interest, only these pixels are plotted and saved
+        self.roi = slice(None)
+        self.roi_wavelengths = self.wavelengths
         self.fig, self.ax = plt.subplots()
-        self.line, = self.ax.plot([], [], 'k-', label="Live Spectrum", lw=0.8, zorder=10)  # Higher zorder for live spectrum
+        # The x-data is fixed, the y-data stays NaN (not drawn) until the first spectrum arrives
+        self.line, = self.ax.plot(self.wavelengths, np.full(len(self.wavelengths), np.nan), 'k-',
+                                  label="Live Spectrum", lw=0.8, zorder=10,  # Higher zorder for live spectrum
+                                  animated=True)  # Drawn by blitting on top of the cached background
         self.ax.set_xlim(self.wavelengths[0], self.wavelengths[-1])
         self.ax.set_ylim(0, 5000)  # Adjust the range according to expected intensity values
         self.ax.grid()
@@ -93,6 +273,12 @@ class SpectrometerApp:
         self.canvas = FigureCanvasTkAgg(self.fig, master=plot_frame)
         self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
         
+        # Cache the static parts of the plot after every full redraw (resize, zoom, legend, ...)
+        self.plot_background = None
+        self.last_frame_time = 0
+        self.last_intensities = None  # Spectrum currently shown by the live line
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+        
         # Add the toolbar for zooming/panning
         self.toolbar = NavigationToolbar2Tk(self.canvas, plot_frame)
         self.toolbar.pack(fill=tk.X)
@@ -118,6 +304,19 @@ class SpectrometerApp:
         self.integration_entry = ttk.Entry(integration_frame, textvariable=self.integration_time_var, width=10)
         self.integration_entry.pack(side=tk.LEFT, padx=5)
         self.integration_entry.bind("<Return>", self.set_integration_time)
+        
+        self.roi_label = ttk.Label(integration_frame, text="Wavelength range (nm):")
+        self.roi_label.pack(side=tk.LEFT, padx=[20,5])
+        
+        self.roi_min_var = tk.StringVar(value="")  # Empty for the edges of the detector
+        self.roi_min_entry = ttk.Entry(integration_frame, textvariable=self.roi_min_var, width=10)
+        self.roi_min_entry.pack(side=tk.LEFT, padx=2)
+        self.roi_min_entry.bind("<Return>", self.set_roi)
+        
+        self.roi_max_var = tk.StringVar(value="")
+        self.roi_max_entry = ttk.Entry(integration_frame, textvariable=self.roi_max_var, width=10)
+        self.roi_max_entry.pack(side=tk.LEFT, padx=2)
+        self.roi_max_entry.bind("<Return>", self.set_roi)
 
         # Filepath entry
         self.filepath_frame = ttk.Frame(control_frame)
@@ -165,6 +364,13 @@ class SpectrometerApp:
         self.scan_step_entry.pack(side=tk.LEFT, padx=2)
         self.scan_step_entry.bind("<Return>", self.calculate_step_number)
         
+        self.scan_settle_label = ttk.Label(self.scan_frame, text="Settle time (ms):")
+        self.scan_settle_label.pack(side=tk.LEFT, padx=[20,5])
+        
+        self.scan_settle_var = tk.StringVar(value="200")  # Lets the stage stop ringing after a move
+        self.scan_settle_entry = ttk.Entry(self.scan_frame, textvariable=self.scan_settle_var, width=10)
+        self.scan_settle_entry.pack(side=tk.LEFT, padx=2)
+        
         self.scan_step_number_label = ttk.Label(self.scan_frame, text="100 Steps", foreground="blue")
         self.scan_step_number_label.pack(side=tk.LEFT, padx=[20,5])
         
@@ -188,7 +394,8 @@ class SpectrometerApp:
         self.bg_button = ttk.Button(button_frame, text="Take Background Spectrum", command=self.take_background)
         self.bg_button.pack(side=tk.LEFT, padx=5, pady=5)
 
-        self.toggle_button = ttk.Checkbutton(button_frame, text="Subtract Background", variable=self.subtract_background)
+        self.toggle_button = ttk.Checkbutton(button_frame, text="Subtract Background", variable=self.subtract_background,
+                                         command=self.toggle_subtract_background)
         self.toggle_button.pack(side=tk.LEFT, padx=5, pady=5)
 
         self.autoscale_button = ttk.Button(button_frame, text="Autoscale Y-Axis", command=self.autoscale_y_axis)
@@ -202,15 +409,20 @@ class SpectrometerApp:
         self.clear_button.pack(side=tk.LEFT, padx=5, pady=5)
 
         # Start the update loop
-        self.paused = False
-        self.data_queue = queue.Queue()
+        self.resume_event = threading.Event()  # Cleared while paused
+        self.resume_event.set()
+        # Single slot holding the newest spectrum for the plot, None once it has been taken
+        self.latest_spectrum = None
+        self.latest_lock = threading.Lock()
         self.running_event = threading.Event()
         self.running_event.set()
         self.request_frog_spectrum = threading.Event()
+        self.frog_spectrum_taken = threading.Event()
+        # The update loop posts this event whenever a new spectrum is waiting in the slot
+        self.root.bind("<<SpectrumReady>>", lambda event: self.update_plot())
         self.update_thread = threading.Thread(target=self.spectrum_update_loop)
         self.update_thread.daemon = True
         self.update_thread.start()
-        self.update_plot()
 
     def create_menu_bar(self):
         # Create a menu bar
@@ -241,14 +453,10 @@ class SpectrometerApp:
 
     def toggle_legend(self):
         # Show or hide the legend based on the menu option
+        # The entries don't change, so the existing legend is only shown or hidden
         self.legend_visible = self.show_legend_var.get()
-        if self.legend_visible:
-            self.legend = self.ax.legend(loc="upper left")
-        else:
-            if self.legend:
-                self.legend.remove()
-                self.legend = None
-        self.canvas.draw()
+        self.legend.set_visible(self.legend_visible)
+        self.canvas.draw_idle()
         print(f"Legend visibility set to {self.legend_visible}")
     
     def toggle_toolbar(self):
@@ -265,27 +473,29 @@ class SpectrometerApp:
         # Puts in a request for taking a background spectrum
         self.request_background = True
 
+    def toggle_subtract_background(self):
+        self.background_enabled = self.subtract_background.get()
+
     def autoscale_y_axis(self):
         # Autoscale y-axis to the current spectrum values
-        intensities = self.line.get_ydata()
-        if intensities.size > 0:
-            self.ax.set_ylim(np.min(intensities), np.max(intensities))
-            self.canvas.draw()
+        intensities = self.last_intensities
+        if intensities is not None:
+            self.ax.set_ylim(*spec_numba.minmax(intensities))
+            self.canvas.draw_idle()
             print("Y-axis autoscaled to current spectrum values.")
         else:
             messagebox.showinfo("Autoscale", "No data available to autoscale Y-axis.")
 
     def take_reference(self):
         # Cache the current spectrum and display it as a new line on the graph
-        intensities = self.line.get_ydata()
-        if intensities.size > 0:
-            reference_line, = self.ax.plot(self.wavelengths, intensities,
+        intensities = self.last_intensities
+        if intensities is not None:
+            reference_line, = self.ax.plot(self.roi_wavelengths, intensities,
                                            label=f"Reference {len(self.reference_lines) + 1}", 
                                            lw=0.5, zorder=1)
             self.reference_lines.append(reference_line)
-            if self.legend_visible:
-                self.legend = self.ax.legend(loc="upper right")
-            self.canvas.draw()
+            self.refresh_legend()
+            self.canvas.draw_idle()
             print(f"Reference {len(self.reference_lines)} taken and displayed.")
         else:
             messagebox.showinfo("Take Reference", "No data available to take as reference.")
@@ -295,114 +505,203 @@ class SpectrometerApp:
         for line in self.reference_lines:
             line.remove()
         self.reference_lines.clear()
-        if self.legend_visible:
-            self.legend = self.ax.legend(loc="upper right")
-        else:
-            if self.legend:
-                self.legend.remove()
-                self.legend = None
-        self.canvas.draw()
+        self.refresh_legend()
+        self.canvas.draw_idle()
         print("All reference lines cleared.")
 
-    def update_plot(self):
-        while not self.data_queue.empty():
-            wavelengths, intensities, timestamp = self.data_queue.get()
-            
-            self.line.set_data(wavelengths, intensities)
-            self.ax.relim()
-            self.ax.autoscale_view(True, True, True)
-            self.canvas.draw()
+    def refresh_legend(self, loc="upper right"):
+        # Rebuild the legend, only called when lines are added or removed (never per frame)
+        if self.legend:
+            self.legend.remove()
+        self.legend = self.ax.legend(loc=loc)
+        self.legend.set_visible(self.legend_visible)
 
-        # Schedule the next update
-        if self.running_event.is_set():
-            self.root.after(100, self.update_plot)
+    def on_draw(self, event):
+        # Store the freshly rendered background and paint the live spectrum on top of it
+        self.plot_background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.ax.draw_artist(self.line)
+
+    def update_plot(self):
+        # Limit the frame rate for short integration times, the slot keeps the newest spectrum
+        # and no further events are posted while it is full, so this call is the only one pending
+        wait = self.last_frame_time + FRAME_INTERVAL - time.perf_counter()
+        if wait > 0:
+            self.root.after(int(wait * 1000) + 1, self.update_plot)
+            return
+        self.last_frame_time = time.perf_counter()
+        
+        # Only the newest spectrum is shown, older ones have been overwritten
+        with self.latest_lock:
+            intensities, self.latest_spectrum = self.latest_spectrum, None
+        if intensities is not None and len(intensities) == len(self.roi_wavelengths):  # Skip frames of a previous ROI
+            self.line.set_ydata(intensities)
+            self.last_intensities = intensities
+            ymin, ymax = self.ax.get_ylim()
+            low, high = spec_numba.minmax(intensities)
+            if self.plot_background is None or low < ymin or high > ymax:
+                # Spectrum leaves the current limits: widen them with some headroom so that
+                # slowly growing signals don't force a full redraw on every frame
+                margin = 0.1 * (max(ymax, high) - min(ymin, low))
+                self.ax.set_ylim(low - margin if low < ymin else ymin, high + margin if high > ymax else ymax)
+                self.canvas.draw()
+            else:
+                # Only redraw the live spectrum on top of the cached background
+                self.canvas.restore_region(self.plot_background)
+                self.ax.draw_artist(self.line)
+                self.canvas.blit(self.ax.bbox)
+
+    def read_ocean_optics(self):
+        # Read spectrum of Ocean Optics, the wavelengths are fixed and cached in self.wavelengths
+        return self.spectrometer.intensities(correct_dark_counts=False, correct_nonlinearity=False)
+
+    def read_avantes(self):
+        # Read spectrum of Avaspec, converted to single precision while copying out of the driver buffer
+        intensities = np.empty(len(self.wavelengths), dtype=np.float32)
+        avs.get_spectrum_into(self.active_spec_handle, intensities)
+        return intensities
+
+    def read_demo(self):
+        time.sleep(self.demo_integration_time / 1000)  # Paces the loop like a real integration
+        # Output noise, generated in single precision and scaled in place
+        # (always a new array, the spectrum is passed on to the plot and the writers)
+        intensities = self.rng.random(1000, dtype=np.float32)
+        intensities *= self.demo_integration_time
+        return intensities
+
+    def apply_ocean_optics_integration_time(self, time_ms):
+        self.spectrometer.integration_time_micros(time_ms * 1000)  # Convert ms to microseconds
+
+    def apply_avantes_integration_time(self, time_ms):
+        avs.AVS_StopMeasure(self.active_spec_handle)
+        avs.set_measure_params(self.active_spec_handle, time_ms, 1)
+        avs.AVS_Measure(self.active_spec_handle)
+
+    def apply_demo_integration_time(self, time_ms):
+        self.demo_integration_time = time_ms
 
     def spectrum_update_loop(self):
         while self.running_event.is_set():
             try:
-                # Pause loop if needed
-                if self.paused:
-                    time.sleep(0.1)  # Wait briefly before checking again
+                # Block while paused, the loop is paced by the (blocking) spectrometer readout otherwise
+                if not self.resume_event.is_set():
+                    self.resume_event.wait()
                     continue
                 
-                if self.spec_type == "OCEAN_OPTICS": # Read spectrum of Ocean Optics
-                    spectrum = self.spectrometer.spectrum()
-                    wavelengths = spectrum[0]
-                    intensities = spectrum[1]
-                
-                if self.spec_type == "AVANTES": # Read spectrum of Avaspec
-                    spectrum = avs.get_spectrum(self.active_spec_handle)
-                    wavelengths = self.wavelengths
-                    intensities = spectrum[1]
+                intensities = self.read_spectrum()
                 
-                if self.spec_type == "DEMO": # Output noise
-                    wavelengths = self.wavelengths
-                    intensities = np.random.rand(1000) * self.demo_integration_time
+                # Single precision is plenty for detector counts and halves the data to move and store
+                intensities = np.asarray(intensities, dtype=np.float32)
                     
-                now = datetime.now()
-                timestamp = (now.hour * 3600 + now.minute * 60 + now.second + now.microsecond / 1e6)
+                timestamp = self.clock_offset + time.perf_counter()
                 
                 if self.request_background:
-                    self.background_spectrum = intensities
+                    self.background_spectrum = intensities.copy()
                     print("Background spectrum taken and cached.")
                     self.request_background = False
                 
-                # Subtract background if enabled
-                if self.subtract_background.get() and self.background_spectrum is not None:
-                    intensities = intensities - self.background_spectrum
+                # Everything after this only sees the pixels in the region of interest
+                roi = self.roi
+                intensities = intensities[roi]
                 
-                # Save spectrum if acquiring
-                if self.acquiring:
-                    self.acquired_spectra.append(intensities)
-                    self.timestamps.append(timestamp)
+                # Subtract background if enabled, in place since every read returns a new array
+                background = self.background_spectrum if self.background_enabled else None
+                if background is not None:
+                    spec_numba.subtract_background(intensities, background[roi], intensities)
                 
-                # Save spectrum if requested by FROG
-                if self.request_frog_spectrum.is_set():
-                    self.acquired_spectra.append(intensities)
-                    self.timestamps.append(timestamp)
-                    position = self.stage.get_position(self.motor_number)
-                    self.stage_values.append(float(position))
+                # Save spectrum if acquiring, a frame still cut to a previous ROI doesn't fit the file
+                writer = self.spectra_writer
+                if self.acquiring and len(intensities) == writer.n_pixels:
+                    writer.append(intensities, timestamp)
+                
+                # Save spectrum if requested by FROG (the request stays pending for frames of a previous ROI)
+                if (self.request_frog_spectrum.is_set()
+                        and len(intensities) == self.acquired_spectra.shape[1]):
+                    self.store_spectrum(intensities, timestamp)
                     self.request_frog_spectrum.clear()
+                    self.frog_spectrum_taken.set()
                     
-                # Send data to the main thread for plotting
-                with self.data_queue.mutex:
-                    self.data_queue.queue.clear()
-                self.data_queue.put((wavelengths, intensities, timestamp))
-
-                time.sleep(0.01) # TODO: Can this be even faster?
+                # Hand the newest spectrum to the main thread for plotting
+                # (the wavelengths are taken from self.roi_wavelengths)
+                with self.latest_lock:
+                    notify = self.latest_spectrum is None
+                    self.latest_spectrum = intensities
+                # Wake up the main thread, once per redraw if spectra arrive faster than they are drawn
+                if notify and self.running_event.is_set():
+                    self.root.event_generate("<<SpectrumReady>>", when="tail")
             except sb.SeaBreezeError as e:
                 print(f"Spectrometer error: {e}")
-                messagebox.showerror("Spectrometer Error", f"Spectrometer error occurred: {e}")
+                self.root.after(0, messagebox.showerror, "Spectrometer Error", f"Spectrometer error occurred: {e}")
                 self.running_event.clear()
             except Exception as e:
                 print(f"Error in spectrum update loop: {e}")
-                messagebox.showerror("Error", f"An error occurred in the spectrum update loop: {e}")
+                self.root.after(0, messagebox.showerror, "Error", f"An error occurred in the spectrum update loop: {e}")
                 self.running_event.clear()
 
+    def store_spectrum(self, intensities, timestamp):
+        # Copy a spectrum and its timestamp into the preallocated arrays, doubling them when full
+        # (the stage position of the row is filled in by the FROG scan thread)
+        if self.n_acquired == len(self.acquired_spectra):
+            capacity = max(1, 2 * self.n_acquired)
+            self.acquired_spectra = grow_rows(self.acquired_spectra, self.n_acquired, capacity)
+            self.acquired_timestamps = grow_rows(self.acquired_timestamps, self.n_acquired, capacity)
+            self.acquired_positions = grow_rows(self.acquired_positions, self.n_acquired, capacity)
+        self.acquired_spectra[self.n_acquired] = intensities
+        self.acquired_timestamps[self.n_acquired] = timestamp
+        self.n_acquired += 1
+
     def set_integration_time(self, event):
         try:
             new_time_ms = int(self.integration_time_var.get())
             if new_time_ms <= 0:
                 raise ValueError("Integration time must be positive")
-            if self.spec_type == "OCEAN_OPTICS":
-                self.spectrometer.integration_time_micros(new_time_ms * 1000)  # Convert ms to microseconds
-            if self.spec_type == "AVANTES":
-                avs.AVS_StopMeasure(self.active_spec_handle)
-                avs.set_measure_params(self.active_spec_handle, new_time_ms, 1)
-                avs.AVS_Measure(self.active_spec_handle)
-            if self.spec_type == "DEMO":
-                self.demo_integration_time = new_time_ms
+            self.apply_integration_time(new_time_ms)
+            self.integration_time_ms = new_time_ms
             print(f"Integration time set to {new_time_ms} ms")
         except ValueError as e:
             messagebox.showerror("Invalid Value", f"Invalid integration time value: {e}")
     
+    def set_roi(self, event=None):
+        # Restrict plotting and saving to the pixels between the two wavelengths
+        if self.acquiring or (self.frog_thread is not None and self.frog_thread.is_alive()):
+            messagebox.showerror("Wavelength range", "The wavelength range can't be changed while acquiring.")
+            return
+        try:
+            roi_min = float(self.roi_min_var.get()) if self.roi_min_var.get() else self.wavelengths[0]
+            roi_max = float(self.roi_max_var.get()) if self.roi_max_var.get() else self.wavelengths[-1]
+        except ValueError:
+            messagebox.showerror("Invalid Value", "Please enter valid wavelengths or leave the fields empty.")
+            return
+        start = np.searchsorted(self.wavelengths, roi_min, side="left")
+        stop = np.searchsorted(self.wavelengths, roi_max, side="right")
+        if stop - start < 2:
+            messagebox.showerror("Wavelength range", "The wavelength range has to contain at least two pixels.")
+            return
+        self.roi = slice(start, stop)
+        self.roi_wavelengths = self.wavelengths[self.roi]
+        self.line.set_data(self.roi_wavelengths, np.full(len(self.roi_wavelengths), np.nan))
+        self.last_intensities = None
+        self.ax.set_xlim(self.roi_wavelengths[0], self.roi_wavelengths[-1])
+        self.canvas.draw_idle()
+        print(f"Wavelength range set to {self.roi_wavelengths[0]:.2f} - {self.roi_wavelengths[-1]:.2f} nm")
+
+    def anchor_clock(self):
+        # Instead of calling datetime.now() per spectrum, re-anchored since the two clocks drift apart
+        now = datetime.now()
+        self.clock_origin = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        self.clock_offset = (now - self.clock_origin).total_seconds() - time.perf_counter()
+
+    def file_attributes(self):
+        # Acquisition settings stored with every saved file
+        return {"integration_time_ms": self.integration_time_ms,
+                "timestamp_origin": self.clock_origin.isoformat()}
+
     def toggle_pause(self):
-        if self.paused:
-            self.paused = False
+        if not self.resume_event.is_set():
+            self.resume_event.set()
             self.pause_button.config(text="Pause")
             print("Spectrum acquisition resumed.")
         else:
-            self.paused = True
+            self.resume_event.clear()
             self.pause_button.config(text="Restart")
             print("Spectrum acquisition paused.")
 
@@ -411,31 +710,63 @@ class SpectrometerApp:
         if self.acquiring:
             self.acquiring = False
             self.acquire_button.config(text="Start acquire")
-            self.acquiring_label.config(text="")
-            self.save_spectra()
+            self.acquiring_label.config(text="Saving...")
+            # Finish the file in the background to keep the window responsive
+            self.save_thread = threading.Thread(target=self.finish_saving, args=(self.spectra_writer,))
+            self.save_thread.daemon = True
+            self.save_thread.start()
         else:
+            # Spectra are streamed to the file while acquiring
+            file_path = self.filepath_var.get()
+            if not file_path:
+                messagebox.showerror("Save Error", "File path is empty. Please provide a valid file path.")
+                return
+            if self.save_thread is not None:
+                self.save_thread.join()  # Previous file has to be closed first
+            self.anchor_clock()
+            try:
+                self.spectra_writer = SpectraWriter(file_path, self.roi_wavelengths, self.file_attributes())
+            except Exception as e:
+                messagebox.showerror("Save Error", f"Failed to create file: {e}")
+                return
             self.acquiring = True
             self.acquire_button.config(text="Stop acquire")
             self.acquiring_label.config(text="Acquiring...")
-            self.acquired_spectra = []  # Reset acquired spectra list
-            self.timestamps = []
+
+    def finish_saving(self, writer):
+        # Runs in a background thread, GUI updates are handed to the main thread
+        try:
+            writer.close()
+            print(f"Data saved to {writer.file_path}")
+            self.root.after(0, self.acquiring_label.config, {"text": ""})
+        except Exception as e:
+            self.root.after(0, self.acquiring_label.config, {"text": "Saving failed"})
+            self.root.after(0, messagebox.showerror, "Save Error", f"Failed to save data: {e}")
 
     def save_spectra(self):
-        # Save the acquired spectra to an HDF5 file
+        # Save the acquired spectra to an HDF5 file, runs in the FROG scan thread
         file_path = self.filepath_var.get()
         if not file_path:
-            messagebox.showerror("Save Error", "File path is empty. Please provide a valid file path.")
+            self.root.after(0, messagebox.showerror, "Save Error", "File path is empty. Please provide a valid file path.")
             return
         try:
-            with h5py.File(file_path, "w") as f:
-                f.create_dataset("wavelengths", data=self.wavelengths)
-                f.create_dataset("spectra", data=np.array(self.acquired_spectra))
-                f.create_dataset("timestamps", data=np.array(self.timestamps))
+            spectra = self.acquired_spectra[:self.n_acquired]
+            if spectra.size == 0:
+                raise ValueError("No spectra have been acquired.")
+            n_spectra, n_pixels = spectra.shape
+            # Chunks of about CHUNK_BYTES, create_spectra_file sizes the chunk cache to hold several of them
+            rows_per_chunk = max(1, min(n_spectra, CHUNK_BYTES // (n_pixels * spectra.itemsize)))
+            with create_spectra_file(file_path, rows_per_chunk * n_pixels * spectra.itemsize) as f:
+                f.create_dataset("wavelengths", data=self.roi_wavelengths)
+                f.attrs.update(self.file_attributes())
+                f.create_dataset("spectra", data=spectra, chunks=(rows_per_chunk, n_pixels),
+                                 **SPECTRA_COMPRESSION)
+                f.create_dataset("timestamps", data=self.acquired_timestamps[:n_spectra])
                 if self.frog_mode:
-                    f.create_dataset("positions", data=np.array(self.stage_values))
+                    f.create_dataset("positions", data=self.acquired_positions[:n_spectra])
             print(f"Data saved to {file_path}")
         except Exception as e:
-            messagebox.showerror("Save Error", f"Failed to save data: {e}")
+            self.root.after(0, messagebox.showerror, "Save Error", f"Failed to save data: {e}")
     
     def save_current_spectrum(self):
         '''Open a savefile dialogue to save the current spectrum'''
@@ -444,13 +775,14 @@ class SpectrometerApp:
             return  # User canceled the save dialog
 
         try:
-            wavelengths = self.line.get_xdata()
-            intensities = self.line.get_ydata()
+            wavelengths = self.roi_wavelengths
+            intensities = self.last_intensities
+            if intensities is None:
+                raise ValueError("No spectrum has been taken yet.")
 
-            with open(file_path, "w") as f:
-                f.write("Wavelength [nm]\tIntensity\n")
-                for wl, inten in zip(wavelengths, intensities):
-                    f.write(f"{wl}\t{inten}\n")
+            # Formatted and written in one go by NumPy instead of one write per pixel
+            np.savetxt(file_path, np.column_stack([wavelengths, intensities]), fmt=("%.4f", "%.6g"),
+                       delimiter="\t", header="Wavelength [nm]\tIntensity", comments="")
 
             print(f"Spectrum saved to {file_path}")
             messagebox.showinfo("Save Successful", f"Spectrum saved to {file_path}")
@@ -482,53 +814,87 @@ class SpectrometerApp:
     def calculate_step_number(self, event=None):
         start = float(self.scan_start_var.get())
         stop = float(self.scan_stop_var.get())
-        step = float(self.scan_step_var.get())
-        if start > stop:  # for reverse scans
-            step=-step
-        self.stage_steps = np.arange(start, stop, step)
+        step = abs(float(self.scan_step_var.get()))  # direction follows from start and stop
+        # Count the steps first, np.arange gains or loses the last one through float rounding.
+        # Same positions as np.arange(start, stop, step): the step is kept, stop is excluded
+        n_steps = int(np.ceil(abs(stop - start) / step - 1e-9))
+        self.stage_steps = start + np.sign(stop - start) * step * np.arange(n_steps)
         self.scan_step_number_label.config(text=(str(len(self.stage_steps))+' Steps'))
     
     def start_frog_scan(self):
-        self.acquired_spectra = []  # Reset acquired spectra list
-        self.timestamps = []
-        self.stage_values = []
+        try:
+            settle_time = float(self.scan_settle_var.get()) / 1000
+            if not np.isfinite(settle_time) or settle_time < 0:
+                raise ValueError("Settle time must not be negative")
+        except ValueError as e:
+            messagebox.showerror("Invalid Value", f"Invalid settle time value: {e}")
+            return
+        self.calculate_step_number()
+        self.settle_time = settle_time
+        self.anchor_clock()
+        # One spectrum per step, so the arrays never have to grow during the scan
+        n_steps = len(self.stage_steps)
+        self.acquired_spectra = np.empty((n_steps, len(self.roi_wavelengths)), dtype=np.float32)
+        self.acquired_timestamps = np.empty(n_steps, dtype=np.float64)
+        self.acquired_positions = np.empty(n_steps, dtype=np.float64)
+        self.n_acquired = 0
         print('Performing FROG scan...')
         self.acquire_button.config(state="disabled")
         self.acquiring_label.config(text="Acquiring FROG scan")
-        self.calculate_step_number()
         self.frog_thread = threading.Thread(target=self.frog_scan_loop)
         self.frog_thread.daemon = True
         self.frog_thread.start()
         
+    def wait_for_stage(self):
+        # Polls quickly at first so short steps finish early, then backs off for long moves
+        while True:
+            try:
+                self.stage.wait_for_motion_done(self.motor_number, initial=0.005, cap=0.05)
+                return
+            except Exception as e:
+                print(f"Exception in checking motion status: {str(e)}")
+                time.sleep(0.05)
+
     def frog_scan_loop(self):
+        # Runs in a background thread, GUI updates are handed to the main thread
         n_steps = len(self.stage_steps)
         for p, position in enumerate(self.stage_steps):
-            self.scan_step_number_label.config(text=f"step {p}/{n_steps}" ,foreground="red")
+            self.root.after(0, self.scan_step_number_label.config, {"text": f"step {p}/{n_steps}", "foreground": "red"})
             self.stage.move_absolute(self.motor_number, str(position))
-            while True:
-                try:
-                    if self.stage.get_motion_status(self.motor_number) is False:
-                        break
-                except Exception as e:
-                    print(f"Exception in checking motion status: {str(e)}")
-                time.sleep(0.05)
-            time.sleep(0.2) # wait 200ms after stop before acquiring spectrum
+            self.wait_for_stage()
+            time.sleep(self.settle_time) # wait after stop before acquiring spectrum
+            self.frog_spectrum_taken.clear()
             self.request_frog_spectrum.set()
-            while self.request_frog_spectrum.is_set():
-                time.sleep(0.05)
-        self.scan_step_number_label.config(text=f"step {n_steps}/{n_steps}" ,foreground="blue")
+            # Position of the resting stage: read by the stage interface during the settle time,
+            # otherwise read back now while the spectrum integrates
+            position = None
+            if self.position_cache is not None:
+                position = self.position_cache.get(self.motor_number, max_age=self.settle_time)
+            if position is None:
+                position = self.stage.get_position(self.motor_number)
+            position = float(position)
+            self.frog_spectrum_taken.wait()
+            self.acquired_positions[self.n_acquired - 1] = position
+        self.root.after(0, self.scan_step_number_label.config, {"text": f"step {n_steps}/{n_steps}", "foreground": "blue"})
         self.save_spectra()
-        time.sleep(2)
+        self.root.after(2000, self.finish_frog_scan)  # Leave the final step count visible for a moment
+
+    def finish_frog_scan(self):
         self.calculate_step_number()
         self.acquiring_label.config(text="")
         self.acquire_button.config(state="enabled")
-        return
 
     def close(self):
         print('Closing...')
         try:
             self.running_event.clear()
-            self.update_thread.join()
+            self.resume_event.set()  # Release the update loop if paused
+            # Bounded wait, the loop may be stuck posting an event to this (blocked) thread
+            self.update_thread.join(timeout=2)
+            if self.acquiring:
+                self.spectra_writer.close()
+            if self.save_thread is not None:
+                self.save_thread.join()
             if self.spec_type == "OCEAN OPTICS":
                 self.spectrometer.close()
             if self.spec_type == "AVANTES":
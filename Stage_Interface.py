@@ -1,9 +1,50 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-import serial.tools.list_ports
 from stage_driver import esp300
 import threading
 import time
+import re
+import math
+import concurrent.futures
+
+# Beginnings of a number that float() doesn't accept yet, e.g. "-", "." or "1e-"
+PARTIAL_NUMBER = re.compile(r"[+-]?\.?|[+-]?(\d+\.?\d*|\.\d+)[eE][+-]?")
+
+BAUDRATE = 19200  # Must match the DIP switches of the controller
+LABEL_INTERVAL = 0.1  # Minimum seconds between two updates of the position label
+
+# Status messages, filled in with str.format
+MSG_HOMING = "Homing motor {}..."
+MSG_HOMED = "Motor {} homed"
+MSG_HOME_FAILED = "Failed to home motor {}."
+MSG_MOVING = "Moving motor {} to position {}..."
+MSG_MOVED = "Motor {} moved to {}"
+MSG_MOVE_FAILED = "Failed to move motor {}."
+
+# Result of the last port scan, shared by all stage windows
+COM_PORT_CACHE_AGE = 5  # Seconds a scan is reused before the ports are listed again
+com_port_cache = {"time": None, "ports": []}
+
+class PositionCache():
+    """Most recent stage positions, shared by everything that shows or records them."""
+    def __init__(self):
+        self.positions = {}  # motor number: (position, time it was read)
+        self.lock = threading.Lock()
+    
+    def update(self, motor, position):
+        """Store a position that was just read from the stage, as a float whatever the reply type."""
+        position = float(position)
+        with self.lock:
+            self.positions[motor] = (position, time.monotonic())
+    
+    def get(self, motor, max_age):
+        """Return the cached position if it was read less than max_age seconds ago, None otherwise."""
+        with self.lock:
+            entry = self.positions.get(motor)
+        if entry is None or time.monotonic() - entry[1] > max_age:
+            return None
+        return entry[0]
+
 
 # Main Application GUI
 class StageControllerApp():
@@ -18,7 +59,21 @@ class StageControllerApp():
         self.stage = stage  # Placeholder for the Stage object
         self.motor_number = motor  # Placeholder for the Stage object
         self.update_thread = None  # Thread for updating position
-        self.running = False  # Control flag for thread
+        self.stop_event = threading.Event()  # Set to stop the update thread
+        self.moving = False  # Set by move commands for fast position updates until the stage stops
+        self.latest_position = None  # Newest reading of the update thread for the label
+        self.label_update_pending = False
+        self.position_text = None  # Text currently shown by the position label
+        self.last_label_time = 0.0
+        # Home and move commands run here, a busy serial line must not freeze the window
+        self.command_worker = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        # Positions read by the update thread, also used by the calling class
+        if parent is not None and getattr(parent, "position_cache", None) is not None:
+            self.position_cache = parent.position_cache
+        else:
+            self.position_cache = PositionCache()
+            if parent is not None:
+                parent.position_cache = self.position_cache
 
         # Create frames for better layout control
         com_frame = tk.Frame(self.root)
@@ -33,9 +88,11 @@ class StageControllerApp():
         self.com_label = tk.Label(com_frame, text="Select COM Port:")
         self.com_label.pack(side="left", padx=5)
         
-        self.com_ports = self.get_com_ports()
+        # Ports are only scanned when the dropdown is opened, the scan can be slow on Windows
+        self.com_ports = []
         self.com_port_var = tk.StringVar(self.root)
-        self.com_port_dropdown = ttk.Combobox(com_frame, textvariable=self.com_port_var, values=self.com_ports, state="readonly")
+        self.com_port_dropdown = ttk.Combobox(com_frame, textvariable=self.com_port_var, values=self.com_ports, state="readonly",
+                                              postcommand=self.refresh_com_ports)
         self.com_port_dropdown.pack(side="left", padx=5)
         
         com_frame.pack(pady=5)
@@ -74,7 +131,10 @@ class StageControllerApp():
         self.move_label = tk.Label(move_frame, text="Move to Position:")
         self.move_label.pack(side="left", padx=5)
         
-        self.position_entry = tk.Entry(move_frame)
+        # Only numbers can be typed, the value is parsed once per keystroke by the validator
+        self.parsed_position = None  # Entry content as float, None while it is incomplete
+        self.position_entry = tk.Entry(move_frame, validate="key",
+                                       validatecommand=(self.root.register(self.validate_position), "%P"))
         self.position_entry.pack(side="left", padx=5)
         self.position_entry.bind("<Return>", lambda event: self.move_stage())
         
@@ -116,8 +176,9 @@ class StageControllerApp():
         
         # Alter interface if a stage is already connected
         if self.stage is not None:
-            self.running = True
+            self.stop_event.clear()
             self.update_thread = threading.Thread(target=self.update_position_thread)
+            self.update_thread.daemon = True  # Never keeps the interpreter alive if close() is skipped
             self.update_thread.start()
             self.status_label.config(text="Already connected to a stage", fg="blue")
             self.com_port_dropdown.config(state="disabled")
@@ -135,9 +196,19 @@ class StageControllerApp():
         self.root.mainloop()
     
     def get_com_ports(self):
-        """Get available COM ports."""
-        ports = serial.tools.list_ports.comports()
-        return [port.device for port in ports]
+        """Get available COM ports, rescanned only if the last scan is older than COM_PORT_CACHE_AGE."""
+        now = time.monotonic()
+        if com_port_cache["time"] is None or now - com_port_cache["time"] > COM_PORT_CACHE_AGE:
+            from serial.tools import list_ports  # Imported on first use, only needed once the dropdown opens
+            ports = list_ports.comports()
+            com_port_cache["ports"] = [port.device for port in ports]
+            com_port_cache["time"] = now
+        return com_port_cache["ports"]
+    
+    def refresh_com_ports(self):
+        """Update the dropdown with the currently available COM ports."""
+        self.com_ports = self.get_com_ports()
+        self.com_port_dropdown.config(values=self.com_ports)
     
     def connect_stage(self):
         """Connect to the stage."""
@@ -149,7 +220,7 @@ class StageControllerApp():
             return
         
         try:
-            self.stage = esp300.ESP300Controller(selected_port, create_lock=True)
+            self.stage = esp300.ESP300Controller(selected_port, baudrate=BAUDRATE, create_lock=True)
             self.stage.turn_motor_on(self.motor_number)
             if self.parent:
                 self.parent.stage = self.stage
@@ -166,8 +237,9 @@ class StageControllerApp():
             self.motor_spinbox.config(state="disabled")
             
             # Start position update thread
-            self.running = True
+            self.stop_event.clear()
             self.update_thread = threading.Thread(target=self.update_position_thread)
+            self.update_thread.daemon = True  # Never keeps the interpreter alive if close() is skipped
             self.update_thread.start()
             
         except Exception as e:
@@ -176,8 +248,9 @@ class StageControllerApp():
     def disconnect_stage(self):
         """Disconnect from the stage."""
         if self.stage:
-            # Stop the update thread
-            self.running = False
+            # Stop the update thread and abort a read it may be waiting in, the port is closed anyway
+            self.stop_event.set()
+            self.cancel_read()
             if self.update_thread:
                 self.update_thread.join()
 
@@ -196,50 +269,125 @@ class StageControllerApp():
             self.velocity_set_button.config(state="disabled")
             self.status_label.config(text="Disconnected from stage", fg="red")
             self.position_label.config(text="Current Position: N/A", fg="blue")  # Reset position display
+            self.position_text = None
             self.errorcode_button.config(state="disabled")
             self.motor_spinbox.config(state="normal")
     
+    def cancel_read(self):
+        """Make a pending serial read of the update thread return immediately."""
+        try:
+            self.stage.serial.cancel_read()
+        except Exception:  # Not supported by every pyserial version and backend
+            pass
+    
     def update_position_thread(self):
-        """Background thread to update the position every 0.2 seconds."""
-        while self.running:
+        """Background thread to update the position, every 0.1 seconds while the stage
+        moves and less often (down to once per second) while it stands still.
+        Failing reads are retried after 0.5, 1, 2, 4 and then every 5 seconds."""
+        idle_ticks = 0  # Consecutive polls with the stage at rest
+        error_count = 0  # Consecutive failed polls
+        queries = [f"{self.motor_number}TP", f"{self.motor_number}MD?"]  # The motor can't change while connected
+        while not self.stop_event.is_set():
             if self.stage:
                 try:
-                    position = self.stage.get_position(self.motor_number)
+                    # Position and motion status in a single serial exchange
+                    position, motion_done = self.stage.query_batch(queries)
+                    position = float(position)  # Same type as get_position returns
+                    self.position_cache.update(self.motor_number, position)
                     # Schedule the position update in the main thread
-                    self.root.after(0, self.update_position_label, position)
+                    self.post_position(position)
+                    error_count = 0
+                    if int(motion_done):
+                        idle_ticks += 1
+                        self.moving = False
+                    else:
+                        idle_ticks = 0
                 except Exception:
-                    self.root.after(0, self.update_position_label, None)
-            time.sleep(0.2)
+                    self.post_position(None)
+                    error_count += 1
+            if error_count:
+                interval = min(5.0, 0.5 * 2**(error_count - 1))  # Back off while the stage doesn't answer
+            else:
+                interval = 0.1 if self.moving or idle_ticks == 0 else min(1.0, 0.2 * idle_ticks)
+            self.stop_event.wait(interval)  # Returns right away when the thread is stopped
     
-    def update_position_label(self, position):
-        """Update the position label in the GUI thread."""
+    def post_position(self, position):
+        """Hand a reading (None for an error) to the GUI thread, at most one update is queued at a time."""
+        self.latest_position = position
+        if not self.label_update_pending:
+            self.label_update_pending = True
+            self.root.after(0, self.update_position_label)
+    
+    def update_position_label(self):
+        """Update the position label in the GUI thread with the newest reading."""
+        wait = self.last_label_time + LABEL_INTERVAL - time.monotonic()
+        if wait > 0:  # Too soon after the last update, show the newest reading once the interval is over
+            self.root.after(int(wait * 1000) + 1, self.update_position_label)
+            return
+        self.last_label_time = time.monotonic()
+        self.label_update_pending = False  # Cleared first, so a reading posted meanwhile queues a new update
+        position = self.latest_position
         if position is not None:
-            self.position_label.config(text="Current Position: "+position, fg="blue")
+            text, color = f"Current Position: {position}", "blue"
         else:
-            self.position_label.config(text="Error reading position", fg="red")
+            text, color = "Error reading position", "red"
+        if text != self.position_text:  # A resting stage doesn't redraw the label
+            self.position_text = text
+            self.position_label.config(text=text, fg=color)
     
     def home_stage(self):
         """Send the stage to home position.""" 
         if self.stage:
-            self.status_label.config(text=f"Homing motor {self.motor_number}...", fg="blue")
-            try:
-                self.stage.search_for_home(self.motor_number)
-                self.status_label.config(text=f"Motor {self.motor_number} homed", fg="green")
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to home motor {self.motor_number}.\n{str(e)}")
+            self.status_label.config(text=MSG_HOMING.format(self.motor_number), fg="blue")
+            self.moving = True
+            self.run_command(self.stage.search_for_home, (self.motor_number,),
+                             MSG_HOMED.format(self.motor_number),
+                             MSG_HOME_FAILED.format(self.motor_number))
     
     def move_stage(self):
         """Move the stage to the specified position."""
         if self.stage:
-            try:
-                position = float(self.position_entry.get())
-                self.status_label.config(text=f"Moving motor {self.motor_number} to position {position}...", fg="blue")
-                self.stage.move_absolute(self.motor_number, position)
-                self.status_label.config(text=f"Motor {self.motor_number} moved to {position}", fg="green")
-            except ValueError:
+            position = self.parsed_position
+            if position is None:
                 messagebox.showerror("Error", "Invalid position. Please enter a valid number.")
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to move motor {self.motor_number}.\n{str(e)}")
+                return
+            self.status_label.config(text=MSG_MOVING.format(self.motor_number, position), fg="blue")
+            self.moving = True
+            self.run_command(self.stage.move_absolute, (self.motor_number, position),
+                             MSG_MOVED.format(self.motor_number, position),
+                             MSG_MOVE_FAILED.format(self.motor_number))
+    
+    def validate_position(self, text):
+        """Accept the new entry text if it is a number or the beginning of one."""
+        try:
+            position = float(text)
+        except ValueError:
+            if not PARTIAL_NUMBER.fullmatch(text):
+                return False
+            self.parsed_position = None
+        else:
+            if not math.isfinite(position):  # float() also takes "nan" and "inf"
+                return False
+            self.parsed_position = position
+        return True
+    
+    def run_command(self, command, args, done_text, error_text):
+        """Run a stage command in the worker thread, the buttons stay disabled until it is done."""
+        self.home_button.config(state="disabled")
+        self.move_button.config(state="disabled")
+        future = self.command_worker.submit(command, *args)
+        future.add_done_callback(lambda f: self.root.after(0, self.command_done, f, done_text, error_text))
+    
+    def command_done(self, future, done_text, error_text):
+        """Report the result of a stage command in the GUI thread."""
+        if self.stage:  # Buttons stay disabled if the stage was disconnected meanwhile
+            self.home_button.config(state="normal")
+            self.move_button.config(state="normal")
+        error = future.exception()
+        if error is None:
+            self.status_label.config(text=done_text, fg="green")
+        else:
+            messagebox.showerror("Error", f"{error_text}\n{str(error)}")
 
     def errors(self):
         error = self.stage.get_errors()
@@ -250,8 +398,11 @@ class StageControllerApp():
     
     def get_target_velocity(self):
         if self.stage:
-            velocity = self.stage.get_velocity(self.motor_number)
-            self.velocity_entry_text.set(str(velocity))
+            try:
+                velocity = self.stage.get_velocity(self.motor_number)
+                self.velocity_entry_text.set(str(velocity))
+            except ValueError as e:
+                messagebox.showerror("Error", f"Failed to read velocity.\n{str(e)}")
     
     def set_target_velocity(self):
         """Set the desired target velocity."""
@@ -268,9 +419,12 @@ class StageControllerApp():
     def close(self):
         """Cleanup and close the application."""
         print('Closing stage UI')
-        self.running = False  # Stop the update thread
+        self.stop_event.set()  # Stop the update thread
+        if self.parent is None:
+            self.cancel_read()  # Only if the port is closed below, the parent may still read from it
         if self.update_thread:
             self.update_thread.join()
+        self.command_worker.shutdown(wait=True)  # Let a pending command finish before the port closes
         if self.parent is None:
             if self.stage:
                 self.stage.close()
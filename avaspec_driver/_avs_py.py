@@ -6,6 +6,101 @@ try:
 except ModuleNotFoundError:
     import _avs_win as dll
 import numpy as np
+import ctypes
+import time
+
+
+# Detector pixel count per device handle, read once instead of before every spectrum
+pixel_cache = {}
+
+# Default measurement configuration per device handle, copied for every new configuration
+measconfig_templates = {}
+
+# Wavelength calibration per device handle, it is fixed while the device is active
+wavelength_cache = {}
+
+# Buffer the DLL writes the spectra into per device handle, with a pointer to it for ctypes
+scope_buffers = {}
+
+# Detector pixels read out per device handle as a slice, set from the measurement configuration
+active_pixels = {}
+
+# Seconds between two AVS_PollScan calls per device handle, set from the measurement configuration
+poll_intervals = {}
+DEFAULT_POLL_INTERVAL = 0.001
+MIN_POLL_INTERVAL = 0.0001
+MAX_POLL_INTERVAL = 0.01
+
+
+def parameter_layout(structure_type):
+    '''Translates a ctypes structure into a numpy dtype with the same memory 
+        layout and the dictionary keys used by AVS_GetParameter. 
+        Returns the dtype, the keys and field names of the scalar fields 
+        and (key, field name) pairs of the array fields.'''
+    
+    names, formats, offsets = [], [], []
+    scalar_keys, scalar_names, array_fields = [], [], []
+    for (name, ctype) in structure_type._fields_:
+        if issubclass(ctype, ctypes.Array) and ctype._type_ is ctypes.c_char:
+            fmt = np.dtype(('S', ctype._length_))   # Strings as bytes, like ctypes
+        else:
+            fmt = np.dtype(ctype)
+        names.append(name)
+        formats.append(fmt)
+        offsets.append(getattr(structure_type, name).offset)
+        key = name.replace('m_', '')
+        key = key.replace('_1', '1')
+        key = key.replace('_2', '1')
+        key = key.replace('_3', '1')
+        if fmt.shape:
+            array_fields.append((key, name))
+        else:
+            scalar_keys.append(key)
+            scalar_names.append(name)
+    dtype = np.dtype({'names': names, 'formats': formats, 'offsets': offsets,
+                      'itemsize': ctypes.sizeof(structure_type)})
+    
+    return dtype, scalar_keys, scalar_names, array_fields
+
+
+# Layout of the device parameters, so they can be read without a loop over the ctypes fields
+(PARAMETER_DTYPE, PARAMETER_SCALAR_KEYS, 
+ PARAMETER_SCALAR_NAMES, PARAMETER_ARRAYS) = parameter_layout(dll.DeviceConfigType)
+
+
+# Names of the error codes returned by the DLL
+ERROR_DICT = {-1: "ERR_INVALID_PARAMETER", -2: "ERR_OPERATION_NOT_SUPPORTED",
+              -3: "ERR_DEVICE_NOT_FOUND", -4: "ERR_INVALID_DEVICE_ID",
+              -5: "ERR_OPERATION_PENDING", -6: "ERR_TIMEOUT",
+              -8: "ERR_INVALID_MEAS_DATA", -9: "ERR_INVALID_SIZE",
+              -10: "ERR_INVALID_PIXEL_RANGE", -11: "ERR_INVALID_INT_TIME",
+              -12: "ERR_INVALID_COMBINATION", -14: "ERR_NO_MEAS_BUFFER_AVAIL",
+              -15: "ERR_UNKNOWN", -16: "ERR_COMMUNICATION",
+              -17: "ERR_NO_SPECTRA_IN_RAM", -18: "ERR_INVALID_DLL_VERSION",
+              -19: "ERR_NO_MEMORY", -20: "ERR_DLL_INITIALIZATION",
+              -21: "ERR_INVALID_STATE", -22: "ERR_INVALID_REPLY",
+              -24: "ERR_ACCESS", -25: "ERR_INTERNAL_READ",
+              -26: "ERR_INTERNAL_WRITE", -27: "ERR_ETHCONN_REUSE",
+              -28: "ERR_INVALID_DEVICE_TYPE", -29: "ERR_SECURE_CFG_NOT_READ",
+              -30: "ERR_UNEXPECTED_MEAS_RESPONSE",
+              -100: "ERR_INVALID_PARAMETER_NR_PIXEL",
+              -101: "ERR_INVALID_PARAMETER_ADC_GAIN",
+              -102: "ERR_INVALID_PARAMETER_ADC_OFFSET",
+              -110: "ERR_INVALID_MEASPARAM_AVG_SAT2",
+              -111: "ERR_INVALID_MEASPARAM_AVG_RAM",
+              -112: "ERR_INVALID_MEASPARAM_SYNC_RAM",
+              -113: "ERR_INVALID_MEASPARAM_LEVEL_RAM",
+              -114: "ERR_INVALID_MEASPARAM_SAT2_RAM",
+              -115: "ERR_INVALID_MEASPARAM_FWVER_RAM",
+              -116: "ERR_INVALID_MEASPARAM_DYNDARK",
+              -120: "ERR_NOT_SUPPORTED_BY_SENSOR_TYPE",
+              -121: "ERR_NOT_SUPPORTED_BY_FW_VER",
+              -122: "ERR_NOT_SUPPORTED_BY_FPGA_VER",
+              -140: "ERR_SL_CALIBRATION_NOT_AVAILABLE",
+              -141: "ERR_SL_STARTPIXEL_NOT_IN_RANGE",
+              -142: "ERR_SL_ENDPIXEL_NOT_IN_RANGE",
+              -143: "ERR_SL_STARTPIX_GT_ENDPIX",
+              -144: "ERR_SL_MFACTOR_OUT_OF_RANGE"}
 
 
 def AVS_Status(avs_status):
@@ -13,43 +108,10 @@ def AVS_Status(avs_status):
         should be == 0.
         If that is not the case, error is raised with given error code.'''
     
-    error_dict = {-1: "ERR_INVALID_PARAMETER", -2: "ERR_OPERATION_NOT_SUPPORTED",
-                    -3: "ERR_DEVICE_NOT_FOUND", -4: "ERR_INVALID_DEVICE_ID",
-                    -5: "ERR_OPERATION_PENDING", -6: "ERR_TIMEOUT",
-                    -8: "ERR_INVALID_MEAS_DATA", -9: "ERR_INVALID_SIZE",
-                    -10: "ERR_INVALID_PIXEL_RANGE", -11: "ERR_INVALID_INT_TIME",
-                    -12: "ERR_INVALID_COMBINATION", -14: "ERR_NO_MEAS_BUFFER_AVAIL",
-                    -15: "ERR_UNKNOWN", -16: "ERR_COMMUNICATION",
-                    -17: "ERR_NO_SPECTRA_IN_RAM", -18: "ERR_INVALID_DLL_VERSION",
-                    -19: "ERR_NO_MEMORY", -20: "ERR_DLL_INITIALIZATION",
-                    -21: "ERR_INVALID_STATE", -22: "ERR_INVALID_REPLY",
-                    -24: "ERR_ACCESS", -25: "ERR_INTERNAL_READ",
-                    -26: "ERR_INTERNAL_WRITE", -27: "ERR_ETHCONN_REUSE",
-                    -28: "ERR_INVALID_DEVICE_TYPE", -29: "ERR_SECURE_CFG_NOT_READ",
-                    -30: "ERR_UNEXPECTED_MEAS_RESPONSE",
-                    -100: "ERR_INVALID_PARAMETER_NR_PIXEL",
-                    -101: "ERR_INVALID_PARAMETER_ADC_GAIN",
-                    -102: "ERR_INVALID_PARAMETER_ADC_OFFSET",
-                    -110: "ERR_INVALID_MEASPARAM_AVG_SAT2",
-                    -111: "ERR_INVALID_MEASPARAM_AVG_RAM",
-                    -112: "ERR_INVALID_MEASPARAM_SYNC_RAM",
-                    -113: "ERR_INVALID_MEASPARAM_LEVEL_RAM",
-                    -114: "ERR_INVALID_MEASPARAM_SAT2_RAM",
-                    -115: "ERR_INVALID_MEASPARAM_FWVER_RAM",
-                    -116: "ERR_INVALID_MEASPARAM_DYNDARK",
-                    -120: "ERR_NOT_SUPPORTED_BY_SENSOR_TYPE",
-                    -121: "ERR_NOT_SUPPORTED_BY_FW_VER",
-                    -122: "ERR_NOT_SUPPORTED_BY_FPGA_VER",
-                    -140: "ERR_SL_CALIBRATION_NOT_AVAILABLE",
-                    -141: "ERR_SL_STARTPIXEL_NOT_IN_RANGE",
-                    -142: "ERR_SL_ENDPIXEL_NOT_IN_RANGE",
-                    -143: "ERR_SL_STARTPIX_GT_ENDPIX",
-                    -144: "ERR_SL_MFACTOR_OUT_OF_RANGE"}
-    
     if avs_status == 0:   # ERR_SUCCESS
         return
-    elif avs_status in error_dict:
-        raise RuntimeError('Avantes driver failed: ' + error_dict[avs_status] +
+    elif avs_status in ERROR_DICT:
+        raise RuntimeError('Avantes driver failed: ' + ERROR_DICT[avs_status] +
                            ', error code ' + str(avs_status))
     raise RuntimeError('Avantes driver failed: error code ' + str(avs_status))
  
@@ -57,11 +119,15 @@ def AVS_Status(avs_status):
  
 def MeasConfig_DefaultValues(handle):
     """Function to return an initialized version of the MeasConfigType.
-        Can be modiefied but also passed on directly."""
+        Can be modiefied but also passed on directly.
+        The defaults are built once per device, later calls only copy them."""
+    
+    if handle in measconfig_templates:
+        return dll.MeasConfigType.from_buffer_copy(measconfig_templates[handle])
         
     measconfig = dll.MeasConfigType()
     
-    pixels = AVS_GetParameter(handle)['Detector_NrPixels']
+    pixels = get_pixels(handle)
     measconfig.m_StartPixel = 0
     measconfig.m_StopPixel = pixels - 1
     
@@ -83,6 +149,7 @@ def MeasConfig_DefaultValues(handle):
     measconfig.m_Control_m_LaserWaveLength = 0.0
     measconfig.m_Control_m_StoreToRam = 0
     
+    measconfig_templates[handle] = dll.MeasConfigType.from_buffer_copy(measconfig)
     return measconfig
 
 
@@ -132,6 +199,12 @@ def AVS_Done():
     ''' 
     
     ret = dll.AVS_Done()
+    pixel_cache.clear()  # Handles are given out anew after the next AVS_Init
+    measconfig_templates.clear()
+    wavelength_cache.clear()
+    poll_intervals.clear()
+    active_pixels.clear()
+    scope_buffers.clear()
     AVS_Status(ret)
     
     return
@@ -221,6 +294,12 @@ def AVS_Deactivate(handle):
     '''
     
     ret = dll.AVS_Deactivate(handle)
+    pixel_cache.pop(handle, None)
+    measconfig_templates.pop(handle, None)
+    wavelength_cache.pop(handle, None)
+    poll_intervals.pop(handle, None)
+    active_pixels.pop(handle, None)
+    scope_buffers.pop(handle, None)
     
     if ret is False:
         raise ValueError('Invalid device handle.')
@@ -246,17 +325,13 @@ def AVS_GetParameter(handle):
     '''
     
     structure = dll.AVS_GetParameter(handle)
+    parameters = np.frombuffer(structure, dtype=PARAMETER_DTYPE)
     
-    dictionary = {}
-    for (name, dtype) in structure._fields_:
-        newname = name.replace('m_', '')
-        newname = newname.replace('_1', '1')
-        newname = newname.replace('_2', '1')
-        newname = newname.replace('_3', '1')
-        content = structure.__getattribute__(name)
-        if type(content) not in [int, float, bool, bytes]:
-            content = np.array(content)
-        dictionary[newname] = content
+    # Scalars as native python types in a single conversion, arrays as views of the structure
+    values = parameters[PARAMETER_SCALAR_NAMES][0].item()
+    dictionary = dict(zip(PARAMETER_SCALAR_KEYS, values))
+    for (key, name) in PARAMETER_ARRAYS:
+        dictionary[key] = parameters[name][0]
     
     if dictionary['Len'] == 0:
         raise RuntimeError('Could not read spectrometer parameters.')
@@ -265,6 +340,30 @@ def AVS_GetParameter(handle):
 
 
 
+def get_pixels(handle):
+    '''
+    Returns the number of detector pixels of the spectrometer. The value is 
+    read from the device parameters at the first call and cached until 
+    the device is deactivated.
+
+    Parameters
+    ----------
+    handle: int
+        the AvsHandle of the spectrometer
+
+    Returns
+    -------
+    int
+        Number of detector pixels.
+    '''
+    
+    if handle not in pixel_cache:
+        pixel_cache[handle] = AVS_GetParameter(handle)['Detector_NrPixels']
+    
+    return pixel_cache[handle]
+
+
+
 def AVS_GetLambda(handle):
     '''
     Returns the wavelength values corresponding to the pixels.
@@ -277,13 +376,63 @@ def AVS_GetLambda(handle):
     Returns
     -------
     np.array
-        Array of wavelength values for pixels (in nm).
+        Array of wavelength values for pixels (in nm). It is read from 
+        the device once and returned read-only on subsequent calls. 
+        Covers all detector pixels, see get_active_wavelengths for the 
+        pixels of the spectra.
     '''
     
-    pixels = AVS_GetParameter(handle)['Detector_NrPixels']
-    wavelengths = np.array(dll.AVS_GetLambda(handle))
+    if handle not in wavelength_cache:
+        pixels = get_pixels(handle)
+        # Copies only the detector pixels out of the 4096 element buffer
+        wavelengths = np.ctypeslib.as_array(dll.AVS_GetLambda(handle))[:pixels].copy()
+        wavelengths.flags.writeable = False   # Shared by all callers
+        wavelength_cache[handle] = wavelengths
     
-    return wavelengths[:pixels]
+    return wavelength_cache[handle]
+
+
+
+def get_active_pixels(handle):
+    '''
+    Returns the detector pixels that the last prepared measurement reads 
+    out, all of them if no measurement was prepared yet.
+
+    Parameters
+    ----------
+    handle: int
+        the AvsHandle of the spectrometer
+
+    Returns
+    -------
+    slice
+        From the start pixel to one past the stop pixel.
+    '''
+    
+    if handle in active_pixels:
+        return active_pixels[handle]
+    
+    return slice(0, get_pixels(handle))
+
+
+
+def get_active_wavelengths(handle):
+    '''
+    Returns the wavelength values corresponding to the pixels read out 
+    by the last prepared measurement, matching the returned spectra.
+
+    Parameters
+    ----------
+    handle: int
+        the AvsHandle of the spectrometer
+
+    Returns
+    -------
+    np.array
+        Array of wavelength values for pixels (in nm), read-only.
+    '''
+    
+    return AVS_GetLambda(handle)[get_active_pixels(handle)]
 
 
 
@@ -310,6 +459,13 @@ def AVS_PrepareMeasure(handle, config=None):
     ret = dll.AVS_PrepareMeasure(handle, config)
     AVS_Status(ret)
     
+    # The spectra only hold the pixels from start to stop pixel
+    active_pixels[handle] = slice(config.m_StartPixel, config.m_StopPixel + 1)
+    
+    # Poll about ten times per scan, long scans don't need a fast poll
+    scan_time = config.m_IntegrationTime * config.m_NrAverages * 1e-3
+    poll_intervals[handle] = min(max(scan_time / 10, MIN_POLL_INTERVAL), MAX_POLL_INTERVAL)
+    
     return
 
 
@@ -404,13 +560,15 @@ def AVS_GetScopeData(handle):
         Timestamp: Ticks count at which last pixel of spectrum is received by microcontroller.
         Ticks are in 10µs units since spectrometer started.
     np.array
-        pixel values of the spectrometer
+        pixel values of the spectrometer, only the pixels read out 
+        (see get_active_pixels)
     '''
     
     timestamp, spectrum = dll.AVS_GetScopeData(handle)
-    pixels = AVS_GetParameter(handle)['Detector_NrPixels']
+    active = get_active_pixels(handle)
     
-    return timestamp, np.array(spectrum[:pixels])
+    # The values of the active pixels start at the beginning of the buffer
+    return timestamp, np.ctypeslib.as_array(spectrum)[:active.stop - active.start]
 
 
 
@@ -430,10 +588,11 @@ def AVS_GetSaturatedPixels(handle):
         Array of bool indicating if pixels are saturated.
     '''
 
-    saturated = AVS_GetSaturatedPixels(handle)
-    pixels = AVS_GetParameter(handle)['Detector_NrPixels']
+    saturated = dll.AVS_GetSaturatedPixels(handle)
+    active = get_active_pixels(handle)
     
-    return np.array(saturated[:pixels], dtype=bool)
+    # View the bytes of the ctypes array as bool, copying only the pixels read out
+    return np.frombuffer(saturated, dtype=np.uint8, count=active.stop - active.start).astype(bool)
 
 
 
@@ -468,12 +627,12 @@ def set_measure_params(handle, time, avg=1, start_px=None, stop_px=None):
     
     measconfig = MeasConfig_DefaultValues(handle)
     
-    pixels = AVS_GetParameter(handle)['Detector_NrPixels']
+    pixels = get_pixels(handle)
     
     if start_px is not None:
-        if type(start_px) is int:
+        if isinstance(start_px, (int, np.integer)):
             if start_px >= 0 and start_px < pixels:
-                measconfig.m_StartPixel = 0
+                measconfig.m_StartPixel = int(start_px)
             else:
                 raise ValueError('Start pixel must be between 0 and', pixels-1,
                                  'but was', start_px)
@@ -482,15 +641,15 @@ def set_measure_params(handle, time, avg=1, start_px=None, stop_px=None):
                             type(start_px))
             
     if stop_px is not None:
-        if type(stop_px) is int:
+        if isinstance(stop_px, (int, np.integer)):
             if stop_px >= 0 and stop_px < pixels:
-                measconfig.m_StopPixel = 0
+                measconfig.m_StopPixel = int(stop_px)
             else:
                 raise ValueError('Stop pixel must be between 0 and', pixels-1,
                                  'but was', stop_px)
         else: 
             raise TypeError('Stop pixel index must be integer but was of type',
-                            type(start_px))
+                            type(stop_px))
     
     measconfig.m_IntegrationTime = time
     measconfig.m_NrAverages = avg
@@ -500,6 +659,30 @@ def set_measure_params(handle, time, avg=1, start_px=None, stop_px=None):
 
 
 
+def wait_for_scan(handle):
+    '''
+    Waits until new measurement data are available. Sleeps between the polls, 
+    so the waiting thread hands the GIL and the CPU to other threads.
+
+    Parameters
+    ----------
+    handle: int
+        AvsHandle of the spectrometer.
+
+    Returns
+    -------
+    None.
+
+    '''
+    
+    interval = poll_intervals.get(handle, DEFAULT_POLL_INTERVAL)
+    while not dll.AVS_PollScan(handle):
+        time.sleep(interval)
+    
+    return
+
+
+
 def get_spectrum(handle):
     '''
     Get current spectrum after or during a measurement.
@@ -519,9 +702,7 @@ def get_spectrum(handle):
 
     '''
     
-    dataready = False
-    while dataready == False:
-        dataready = AVS_PollScan(handle)
+    wait_for_scan(handle)
     t, spectrum = AVS_GetScopeData(handle)
     timestamp = t/100000
     
@@ -529,6 +710,66 @@ def get_spectrum(handle):
 
 
 
+def get_scope_buffer(handle):
+    '''
+    Returns the buffer the DLL writes the spectra of the device into, 
+    created at the first call.
+
+    Parameters
+    ----------
+    handle: int
+        AvsHandle of the spectrometer.
+
+    Returns
+    -------
+    buffer: np.array
+        Array of 4096 doubles.
+    pointer: ctypes.POINTER(ctypes.c_double)
+        Pointer to the buffer, to be passed to the DLL.
+
+    '''
+    
+    if handle not in scope_buffers:
+        buffer = np.empty(dll.MAX_NR_PIXELS, dtype=np.float64)
+        scope_buffers[handle] = (buffer, buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_double)))
+    
+    return scope_buffers[handle]
+
+
+
+def get_spectrum_into(handle, out):
+    '''
+    Get current spectrum after or during a measurement and copy it into 
+    an existing array instead of returning a new one.
+
+    Parameters
+    ----------
+    handle: int
+        AvsHandle of the spectrometer.
+    out: np.array
+        Array receiving the pixel values, one element per pixel read out 
+        (see get_active_pixels). The values are converted to its dtype 
+        while copying.
+
+    Returns
+    -------
+    timestamp: float
+        Time in seconds at which last pixel of spectrum is received by 
+        microcontroller.
+
+    '''
+    
+    buffer, pointer = get_scope_buffer(handle)
+    
+    wait_for_scan(handle)
+    t = dll.AVS_GetScopeDataInto(handle, pointer)
+    active = get_active_pixels(handle)
+    out[:] = buffer[:active.stop - active.start]
+    
+    return t/100000
+
+
+
 def acquire_single_spectrum(handle, config=None):
     '''
     Simple function to acquire a single spectrum with the provided 
@@ -556,3 +797,58 @@ def acquire_single_spectrum(handle, config=None):
     AVS_Measure(handle, nummeas=1, windowhandle=0)
     
     return get_spectrum(handle)
+
+
+
+def acquire_n_spectra(handle, n, config=None):
+    '''
+    Acquires n consecutive spectra with a single measurement command 
+    and returns them stacked in a single array.
+
+    Parameters
+    ----------
+    handle: int
+        the AvsHandle of the spectrometer
+    n: int
+        Number of spectra to acquire, 1 to 65533. The two larger values 
+        of the 16 bit count are reserved (-1: measure until stopped, 
+        -2: Dynamic StoreToRam).
+    config: MeasConfigType, optional
+        Measurement Configuration. 
+        Defaults to MeasConfig_DefaultValues.
+
+    Returns
+    -------
+    timestamps: np.array
+        Time in seconds at which last pixel of each spectrum is received by 
+        microcontroller.
+    spectra: np.array
+        Pixel values of the spectrometer, one row per spectrum.
+
+    '''
+    
+    # nummeas is an unsigned 16 bit number, larger counts would wrap around
+    # and 65535/65534 are the special values -1/-2
+    if not 1 <= n <= 65533:
+        raise ValueError('Number of spectra must be between 1 and 65533.')
+    AVS_PrepareMeasure(handle, config)
+    active = get_active_pixels(handle)
+    pixels = active.stop - active.start
+    timestamps = np.empty(n)
+    spectra = np.empty((n, pixels))
+    buffer, pointer = get_scope_buffer(handle)
+    
+    AVS_Measure(handle, nummeas=n, windowhandle=0)
+    
+    try:
+        for i in range(n):
+            wait_for_scan(handle)
+            timestamps[i] = dll.AVS_GetScopeDataInto(handle, pointer)
+            spectra[i] = buffer[:pixels]
+    except BaseException:
+        # Don't leave the spectrometer measuring when reading fails or is interrupted
+        AVS_StopMeasure(handle)
+        raise
+    timestamps /= 100000
+    
+    return timestamps, spectra
@@ -166,6 +166,10 @@ class DstrStatusType(ctypes.Structure):
               ("m_IsInternalErrorEvent", ctypes.c_uint8),
               ("m_Reserved", ctypes.c_uint8)]
 
+# Library functions used for every measurement, bound on their first call and reused afterwards.
+# Building the ctypes prototype takes longer than the call into the library itself.
+bound_functions = {}
+
 def AVS_Init(a_Port = 0):
     """
     Initializes the communication interface with the spectrometers.
@@ -346,10 +350,11 @@ def AVS_PrepareMeasure(handle, measconf):
     :param measconf: MeasConfigType containing measurement configuration.
     :return: SUCCESS = 0 or FAILURE <> 0
     """    
-    prototype = func(ctypes.c_int, ctypes.c_int, ctypes.POINTER(MeasConfigType))
-    paramflags = (1, "handle",), (1, "measconf",),  
-    AVS_PrepareMeasure = prototype(("AVS_PrepareMeasure", lib), paramflags)
-    ret = AVS_PrepareMeasure(handle, measconf)
+    if "AVS_PrepareMeasure" not in bound_functions:
+        prototype = func(ctypes.c_int, ctypes.c_int, ctypes.POINTER(MeasConfigType))
+        paramflags = (1, "handle",), (1, "measconf",),  
+        bound_functions["AVS_PrepareMeasure"] = prototype(("AVS_PrepareMeasure", lib), paramflags)
+    ret = bound_functions["AVS_PrepareMeasure"](handle, measconf)
     return ret
 
 def AVS_Measure(handle, windowhandle, nummeas):
@@ -366,13 +371,14 @@ def AVS_Measure(handle, windowhandle, nummeas):
     start Dynamic StoreToRam
     :return: SUCCESS = 0 or FAILURE <> 0
     """
-    if not (('linux' in sys.platform) or ('darwin' in sys.platform)):
-        prototype = func(ctypes.c_int, ctypes.c_int, ctypes.wintypes.HWND, ctypes.c_uint16)
-    else:
-        prototype = func(ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_uint16)
-    paramflags = (1, "handle",), (1, "windowhandle",), (1, "nummeas"),
-    AVS_Measure = prototype(("AVS_Measure", lib), paramflags)
-    ret = AVS_Measure(handle, windowhandle, nummeas) 
+    if "AVS_Measure" not in bound_functions:
+        if not (('linux' in sys.platform) or ('darwin' in sys.platform)):
+            prototype = func(ctypes.c_int, ctypes.c_int, ctypes.wintypes.HWND, ctypes.c_uint16)
+        else:
+            prototype = func(ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_uint16)
+        paramflags = (1, "handle",), (1, "windowhandle",), (1, "nummeas"),
+        bound_functions["AVS_Measure"] = prototype(("AVS_Measure", lib), paramflags)
+    ret = bound_functions["AVS_Measure"](handle, windowhandle, nummeas) 
     return ret
 
 class AVS_MeasureCallbackFunc(object):
@@ -438,10 +444,11 @@ def AVS_StopMeasure(handle):
     :param handle: AvsHandle of the spectrometer
     :return: SUCCESS = 0 or FAILURE <> 0
     """      
-    prototype = func(ctypes.c_int, ctypes.c_int)
-    paramflags = (1, "handle",),
-    AVS_StopMeasure = prototype(("AVS_StopMeasure", lib), paramflags)
-    ret = AVS_StopMeasure(handle)
+    if "AVS_StopMeasure" not in bound_functions:
+        prototype = func(ctypes.c_int, ctypes.c_int)
+        paramflags = (1, "handle",),
+        bound_functions["AVS_StopMeasure"] = prototype(("AVS_StopMeasure", lib), paramflags)
+    ret = bound_functions["AVS_StopMeasure"](handle)
     return ret
 
 def AVS_PollScan(handle):
@@ -451,10 +458,11 @@ def AVS_PollScan(handle):
     :param handle: AvsHandle of the spectrometer
     :return: 0 = no data available or 1 = data available
     """  
-    prototype = func(ctypes.c_bool, ctypes.c_int)
-    paramflags = (1, "handle",),
-    AVS_PollScan = prototype(("AVS_PollScan", lib), paramflags)
-    ret = AVS_PollScan(handle)
+    if "AVS_PollScan" not in bound_functions:
+        prototype = func(ctypes.c_bool, ctypes.c_int)
+        paramflags = (1, "handle",),
+        bound_functions["AVS_PollScan"] = prototype(("AVS_PollScan", lib), paramflags)
+    ret = bound_functions["AVS_PollScan"](handle)
     return ret
     
 def AVS_GetScopeData(handle):
@@ -467,12 +475,30 @@ def AVS_GetScopeData(handle):
     microcontroller ticks in 10 microsecond units since spectrometer started
     :return spectrum: 4096 element array of doubles, pixels values of spectrometer
     """
-    prototype = func(ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_uint32), ctypes.POINTER(ctypes.c_double * 4096))
-    paramflags = (1, "handle",), (2, "timelabel",), (2, "spectrum",),
-    AVS_GetScopeData = prototype(("AVS_GetScopeData", lib), paramflags)
-    timestamp, spectrum = AVS_GetScopeData(handle)
+    if "AVS_GetScopeData" not in bound_functions:
+        prototype = func(ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_uint32), ctypes.POINTER(ctypes.c_double * 4096))
+        paramflags = (1, "handle",), (2, "timelabel",), (2, "spectrum",),
+        bound_functions["AVS_GetScopeData"] = prototype(("AVS_GetScopeData", lib), paramflags)
+    timestamp, spectrum = bound_functions["AVS_GetScopeData"](handle)
     return timestamp, spectrum
 
+def AVS_GetScopeDataInto(handle, spectrum):
+    """
+    Same as AVS_GetScopeData, but the pixel values are written into a buffer 
+    supplied by the caller instead of a newly allocated array.
+    
+    :param handle: the AvsHandle of the spectrometer
+    :param spectrum: pointer to a buffer of at least 4096 doubles
+    :return timestamp: ticks count last pixel of spectrum is received by 
+    microcontroller ticks in 10 microsecond units since spectrometer started
+    """
+    if "AVS_GetScopeDataInto" not in bound_functions:
+        prototype = func(ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_uint32), ctypes.POINTER(ctypes.c_double))
+        paramflags = (1, "handle",), (2, "timelabel",), (1, "spectrum",),
+        bound_functions["AVS_GetScopeDataInto"] = prototype(("AVS_GetScopeData", lib), paramflags)
+    timestamp = bound_functions["AVS_GetScopeDataInto"](handle, spectrum)
+    return timestamp
+
 def AVS_GetSaturatedPixels(handle):
     """
     Returns the saturation values of the last performed measurement. Should be 
@@ -481,10 +507,11 @@ def AVS_GetSaturatedPixels(handle):
     :param handle: the AvsHandle of the spectrometer
     :return saturated: 4096 element array of bytes, 1 = saturated and 0 = not saturated
     """
-    prototype = func(ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_uint8 * 4096))    
-    paramflags = (1, "handle",), (2, "saturated",),
-    AVS_GetSaturatedPixels = prototype(("AVS_GetSaturatedPixels", lib), paramflags)
-    saturated = AVS_GetSaturatedPixels(handle)
+    if "AVS_GetSaturatedPixels" not in bound_functions:
+        prototype = func(ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_uint8 * 4096))    
+        paramflags = (1, "handle",), (2, "saturated",),
+        bound_functions["AVS_GetSaturatedPixels"] = prototype(("AVS_GetSaturatedPixels", lib), paramflags)
+    saturated = bound_functions["AVS_GetSaturatedPixels"](handle)
     return saturated 
 
 def AVS_GetLambda(handle):
@@ -496,10 +523,11 @@ def AVS_GetLambda(handle):
     :return: 4096 element array of wavelength values for pixels. If the detector
     is less than 4096 pixels, zeros are returned for extra pixels.
     """
-    prototype = func(ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_double * 4096))
-    paramflags = (1, "handle",), (2, "wavelength",),
-    AVS_GetLambda = prototype(("AVS_GetLambda", lib), paramflags)
-    ret = AVS_GetLambda(handle)
+    if "AVS_GetLambda" not in bound_functions:
+        prototype = func(ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_double * 4096))
+        paramflags = (1, "handle",), (2, "wavelength",),
+        bound_functions["AVS_GetLambda"] = prototype(("AVS_GetLambda", lib), paramflags)
+    ret = bound_functions["AVS_GetLambda"](handle)
     return ret
 
 def AVS_GetNumPixels(handle):
@@ -598,9 +626,11 @@ def AVS_GetParameter(handle, size = 63484):
     :param size: size in bytes allocated to store DeviceConfigType
     :return: DeviceConfigType structure containing spectrometer configuration data
     """
-    prototype = func(ctypes.c_int, ctypes.c_int, ctypes.c_uint32, ctypes.POINTER(ctypes.c_uint32), ctypes.POINTER(DeviceConfigType))
-    paramflags = (1, "handle",), (1, "size",), (2, "reqsize",), (2, "deviceconfig",),
-    AVS_GetParameter = prototype(("AVS_GetParameter", lib), paramflags)
+    if "AVS_GetParameter" not in bound_functions:
+        prototype = func(ctypes.c_int, ctypes.c_int, ctypes.c_uint32, ctypes.POINTER(ctypes.c_uint32), ctypes.POINTER(DeviceConfigType))
+        paramflags = (1, "handle",), (1, "size",), (2, "reqsize",), (2, "deviceconfig",),
+        bound_functions["AVS_GetParameter"] = prototype(("AVS_GetParameter", lib), paramflags)
+    AVS_GetParameter = bound_functions["AVS_GetParameter"]
     ret = AVS_GetParameter(handle, size)
     if ret[0] != size:
         ret = AVS_GetParameter(ret[0])
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+'''Per-frame spectrum kernels.
+They are compiled with numba (and cached on disk) when it is installed
+and fall back to plain NumPy otherwise, the results are the same.'''
+
+import numpy as np
+try:
+    from numba import njit
+except ImportError:  # Optional
+    njit = None
+
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def subtract_background(intensities, background, out):
+        for k in range(intensities.size):
+            out[k] = intensities[k] - background[k]
+else:
+    def subtract_background(intensities, background, out):
+        np.subtract(intensities, background, out=out)
+
+
+if njit is not None:
+    @njit(cache=True)
+    def minmax(intensities):
+        # Both limits in a single pass over the spectrum
+        low = intensities[0]
+        high = intensities[0]
+        for value in intensities:
+            if value < low:
+                low = value
+            elif value > high:
+                high = value
+        return low, high
+else:
+    def minmax(intensities):
+        return intensities.min(), intensities.max()
+
+
+def warm_up():
+    '''Compile the kernels for the float32 spectra of the acquisition loop,
+    so the first real frame doesn't have to wait for the JIT.'''
+    frame = np.zeros(1, dtype=np.float32)
+    subtract_background(frame, frame, frame)
+    minmax(frame)
+
+
+warm_up()
@@ -2,12 +2,27 @@
 
 import serial
 import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
 
 
 class ESP300Controller:
-    '''A Python interface to the Newport ESP300 Motion Controller using RS-232 communication.'''
+    '''A Python interface to the Newport ESP300 Motion Controller using RS-232 communication.
+    Can be used as a context manager that closes the connection on exit.'''
     
-    def __init__(self, port='COM27', baudrate=19200, timeout=1, create_lock=False):
+    TERMINATOR = b"\r"  # Ends every command line sent to the controller
+    ENCODING = "ascii"  # Of the replies, a garbled byte is replaced instead of raising an error
+    STOP_TIMEOUT = 10  # Seconds an axis stopped after a timeout may take until its held reply arrives
+    
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def encode_command(command):
+        """Command line as bytes, cached since polling sends the same commands over and over."""
+        return command.encode(ESP300Controller.ENCODING) + ESP300Controller.TERMINATOR
+    
+    def __init__(self, port='COM27', baudrate=19200, timeout=1, create_lock=False, low_latency=True,
+                 sync=True):
         """
         Initializes the connection to the ESP300 motion controller.
         
@@ -16,30 +31,74 @@ class ESP300Controller:
         port : str
             Serial port to which the controller is connected.
         baudrate : int
-            Communication baud rate (default: 19200).
+            Communication baud rate (default: 19200). Higher rates shorten 
+            every exchange with the controller, but have to be selected 
+            with the DIP switches on the back of the controller as well.
         timeout : int
-            Communication timeout in seconds.
+            Communication timeout in seconds, for reading and writing.
         create_lock : bool
             If True a threading.Lock is created that is acquired before every 
             serial communication with the stage and released afterwards.
             This helps thread safety when it is commanded by multiple threads.
-            Default is False.
-        """
-        self.port = port
-        self.baudrate = baudrate
-        self.bytesize=serial.EIGHTBITS
-        self.parity=serial.PARITY_NONE
-        self.stopbits=serial.STOPBITS_ONE
-        self.timeout = timeout
-        self.serial = serial.Serial(port, baudrate, bytesize=self.bytesize,
-                                    parity=self.parity, stopbits=self.stopbits, 
-                                    timeout=timeout)
+            Otherwise self.lock is a nullcontext. Default is False.
+        low_latency : bool
+            If True the USB-serial adapter is asked to pass on received bytes 
+            immediately instead of collecting them for several milliseconds, 
+            which shortens every query. Only available on Linux, ignored if 
+            the adapter doesn't support it. Default is True.
+        sync : bool
+            If True the version is queried after opening the port and 
+            everything received before its reply is discarded, see sync(). 
+            Default is True.
+        """
+        # The port settings are only kept by the serial object, see the properties below
+        self.serial = serial.Serial(port, baudrate, bytesize=serial.EIGHTBITS,
+                                    parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE, 
+                                    timeout=timeout, write_timeout=timeout)
+        if hasattr(self.serial, "set_buffer_size"):  # Windows only
+            self.serial.set_buffer_size(rx_size=4096)
+        if low_latency and hasattr(self.serial, "set_low_latency_mode"):  # Linux only
+            try:
+                self.serial.set_low_latency_mode(True)
+            except (OSError, ValueError):  # Not supported by every adapter
+                pass
         if create_lock:
             self.lock = threading.Lock()
         else:
-            self.lock = None
+            self.lock = nullcontext()  # Used in the same with-blocks, but doesn't lock
+        # Only held while writing, abort_motion writes without the lock above
+        self.write_lock = threading.Lock()
+        self.batch_commands = None  # Commands collected inside batch()
+        self.batch_thread = None
+        self.read_buffer = b""  # Bytes received after the last line that was read
+        # Replies that only change through commands of this class, per axis
+        self.id_cache = {}
+        self.homing_mode_cache = {}
+        # Bytes left over by an earlier session must not be taken as replies
+        self.serial.reset_input_buffer()
+        self.serial.reset_output_buffer()
+        if sync:
+            self.sync()
         
 
+    def write(self, data):
+        """
+        Writes an encoded command line to the serial port.
+        
+        Parameters
+        ----------
+        data : bytes
+            The command line including its terminator.
+        
+        Notes
+        -----
+        Writes never overlap, not even those of abort_motion, which 
+        doesn't wait for the lock. On Windows pyserial shares one 
+        overlapped structure between all writes to a port.
+        """
+        with self.write_lock:
+            self.serial.write(data)
+    
     def send_command(self, command):
         """
         Sends a command to the ESP300 controller.
@@ -49,11 +108,169 @@ class ESP300Controller:
         command : str
             The command string to be sent to the controller.
         """
-        if self.lock is not None: self.lock.acquire()
-        full_command = f"{command}\r"
-        self.serial.write(full_command.encode())
-        if self.lock is not None: self.lock.release()
-
+        if self.batch_commands is not None and self.batch_thread == threading.get_ident():
+            self.batch_commands.append(command)
+            return
+        full_command = self.encode_command(command)
+        with self.lock:
+            self.write(full_command)
+    
+    @property
+    def port(self):
+        """Serial port to which the controller is connected."""
+        return self.serial.port
+    
+    @property
+    def baudrate(self):
+        """Communication baud rate."""
+        return self.serial.baudrate
+    
+    @property
+    def bytesize(self):
+        return self.serial.bytesize
+    
+    @property
+    def parity(self):
+        return self.serial.parity
+    
+    @property
+    def stopbits(self):
+        return self.serial.stopbits
+    
+    @property
+    def timeout(self):
+        """Communication timeout in seconds."""
+        return self.serial.timeout
+    
+    @contextmanager
+    def batch(self):
+        """
+        Collects the commands sent inside a with-block and sends them 
+        to the controller as a single line when the block is left.
+        
+        Usage: with stage.batch(): stage.turn_motor_on(1); stage.move_absolute(1, 5)
+        
+        Notes
+        -----
+        The commands are separated by semicolons, which the controller 
+        executes in order. Only commands without a reply (send_command) 
+        may be used inside the block. Other threads using the controller 
+        wait until the batch has been sent.
+        """
+        with self.lock:
+            self.batch_commands = []
+            self.batch_thread = threading.get_ident()
+            try:
+                yield
+                if self.batch_commands:
+                    full_command = self.encode_command(";".join(self.batch_commands))
+                    self.write(full_command)
+            finally:
+                self.batch_commands = None
+                self.batch_thread = None
+
+    def sync(self):
+        """
+        Brings replies and commands back in step by querying the controller 
+        version and discarding everything received before its reply.
+        
+        Command: VE?
+        
+        Returns
+        -------
+        str or None
+            The version reply, None if it did not arrive.
+        """
+        with self.lock:
+            return self.resync()
+    
+    def resync(self, timeout=None):
+        """
+        Same as sync, for a caller that already holds the lock.
+        
+        Parameters
+        ----------
+        timeout : float, optional
+            Seconds to wait for the version reply, e.g. while replies 
+            held back by WS are still to come (default: serial timeout).
+        
+        Returns
+        -------
+        str or None
+            The version reply, None if it did not arrive.
+        """
+        if timeout is None:
+            timeout = self.serial.timeout
+        deadline = time.monotonic() + timeout
+        self.read_buffer = b""
+        self.serial.reset_input_buffer()
+        self.write(self.encode_command("VE?"))
+        # Stale lines are skipped until the version reply
+        while True:
+            line = self.read_line()
+            if b"ESP" in line:
+                return line.decode(self.ENCODING, "replace").strip()
+            if time.monotonic() > deadline:
+                return None
+    
+    def read_line(self):
+        """
+        Reads one reply line from the controller.
+        
+        Returns
+        -------
+        bytes
+            The line including its line feed, or the bytes received 
+            until the timeout if the line is incomplete.
+        
+        Notes
+        -----
+        All bytes that are already waiting are read at once, instead of 
+        one per call as with readline. Bytes after the line feed are kept 
+        for the next call. Only to be used while holding the lock.
+        """
+        buffer = self.read_buffer
+        while b"\n" not in buffer:
+            received = self.serial.read(self.serial.in_waiting or 1)
+            if not received:  # Timeout
+                break
+            buffer += received
+        line, line_feed, self.read_buffer = buffer.partition(b"\n")
+        return line + line_feed
+    
+    def read_line_before(self, deadline, axis):
+        """
+        Reads one reply line held back by WS, waiting longer than 
+        the serial timeout if necessary.
+        
+        Parameters
+        ----------
+        deadline : float
+            time.monotonic() value until which to wait for the line.
+        axis : int
+            Axis the WS waits for, stopped if the deadline passes.
+        
+        Returns
+        -------
+        bytes or None
+            The complete line, None if it did not arrive before the deadline.
+        
+        Notes
+        -----
+        Only to be used while holding the lock. After a timeout the axis 
+        is stopped, which releases the held reply, and the connection is 
+        resynchronized, since the late reply would otherwise answer the 
+        next command.
+        """
+        line = b""
+        while not line.endswith(b"\n"):
+            if time.monotonic() > deadline:
+                self.write(self.encode_command(f"{axis}ST"))
+                self.resync(self.STOP_TIMEOUT)
+                return None
+            line += self.read_line()
+        return line
+    
     def read_response(self, command):
         """
         Sends a command to the controller.
@@ -69,13 +286,89 @@ class ESP300Controller:
         str
             The response from the controller.
         """
-        full_command = f"{command}\r"
-        if self.lock is not None: self.lock.acquire()
-        self.serial.write(full_command.encode())
-        reply = self.serial.readline().decode().strip()
-        if self.lock is not None: self.lock.release()
+        full_command = self.encode_command(command)
+        with self.lock:
+            self.write(full_command)
+            reply = self.read_line().decode(self.ENCODING, "replace").strip()
         return reply
     
+    def read_float(self, command):
+        """
+        Sends a command to the controller.
+        Reads its numeric response and returns it as a float.
+        
+        Parameters
+        ----------
+        command : str
+            The command string to be sent to the controller.
+        
+        Returns
+        -------
+        float
+            The response from the controller.
+        """
+        full_command = self.encode_command(command)
+        with self.lock:
+            self.write(full_command)
+            reply = self.read_line()
+        return float(reply)  # Parses the bytes directly, surrounding whitespace is ignored
+    
+    def read_bool(self, command):
+        """
+        Sends a command to the controller.
+        Reads its 0 or 1 response and returns it as a bool.
+        
+        Parameters
+        ----------
+        command : str
+            The command string to be sent to the controller.
+        
+        Returns
+        -------
+        bool
+            The response from the controller.
+        """
+        full_command = self.encode_command(command)
+        with self.lock:
+            self.write(full_command)
+            reply = self.read_line().strip()
+        # Compared as bytes, without converting to a number first
+        if reply == b"1":
+            return True
+        if reply == b"0":
+            return False
+        raise ValueError(f"Unexpected reply to {command}: {reply!r}")
+    
+    def query_batch(self, commands):
+        """
+        Sends several queries to the controller in a single line.
+        Reads all of their replies and returns them as strings.
+        
+        Parameters
+        ----------
+        commands : list of str
+            The query commands, each with a single value reply, 
+            e.g. ["1TP", "1MD?"].
+        
+        Returns
+        -------
+        list of str
+            The replies in the order of the commands. Shorter than 
+            commands if the controller did not answer all of them 
+            before the timeout.
+        """
+        full_command = self.encode_command(";".join(commands))
+        replies = []
+        with self.lock:
+            self.write(full_command)
+            # The replies come comma separated, possibly spread over several lines
+            while len(replies) < len(commands):
+                line = self.read_line().decode(self.ENCODING, "replace").strip()
+                if not line:
+                    break
+                replies.extend(reply.strip() for reply in line.split(','))
+        return replies
+    
     
     def get_id(self, axis):
         """
@@ -92,8 +385,17 @@ class ESP300Controller:
         -------
         arr of str
             stage model, serial number
-        """
-        return self.read_response(f"{axis}ID?").split(',')
+        
+        Notes
+        -----
+        The reply is read once per axis and stored.
+        """
+        if axis in self.id_cache:
+            return list(self.id_cache[axis])
+        reply = self.read_response(f"{axis}ID?")
+        if reply:  # Not stored if the controller didn't answer in time
+            self.id_cache[axis] = reply.split(',')
+        return reply.split(',')
     
     def get_errors(self):
         """
@@ -125,7 +427,7 @@ class ESP300Controller:
         bool
             True if specified motor is on.
         """
-        return bool(int(self.read_response(f"{axis}MO?")))
+        return self.read_bool(f"{axis}MO?")
 
     def turn_motor_on(self, axis):
         """
@@ -175,6 +477,7 @@ class ESP300Controller:
             6: find negative limit and index signals
         """
         self.send_command(f"{axis}OM{mode}")
+        self.homing_mode_cache.pop(axis, None)
 
     def get_homing_mode(self, axis):
         """
@@ -198,8 +501,17 @@ class ESP300Controller:
             4: find negative limit signal
             5: find positive limit and index signals
             6: find negative limit and index signals
+        
+        Notes
+        -----
+        The reply is stored until set_homing_mode or reset_controller is called.
         """
-        return self.read_response(f"{axis}OM?")
+        if axis in self.homing_mode_cache:
+            return self.homing_mode_cache[axis]
+        reply = self.read_response(f"{axis}OM?")
+        if reply:
+            self.homing_mode_cache[axis] = reply
+        return reply
     
     def search_for_home(self, axis, mode=None):
         """
@@ -231,8 +543,15 @@ class ESP300Controller:
         Stops motion on all axes immediately.
 
         Command: AB
+        
+        Notes
+        -----
+        Written without waiting for the lock or being collected by 
+        batch(), so that a thread waiting for a reply doesn't delay the 
+        stop. It only waits for a write in progress to finish. It is the 
+        only method that may be called at any time.
         """
-        self.send_command("AB")
+        self.write(self.encode_command("AB"))
     
     def move_absolute(self, axis, position):
         """
@@ -249,6 +568,61 @@ class ESP300Controller:
         """
         self.send_command(f"{axis}PA{position}")
 
+    def move_absolute_axes(self, positions):
+        """
+        Moves several axes to absolute positions at the same time, 
+        with a single command line.
+
+        Command: PA
+        
+        Parameters
+        ----------
+        positions : dict
+            Desired absolute position in predefined units for each 
+            axis number, e.g. {1: 5.0, 2: -1.5}.
+        """
+        self.send_command(";".join(f"{axis}PA{position}" for (axis, position) in positions.items()))
+
+    def move_and_read(self, axis, position, settle_ms=0, timeout=60):
+        """
+        Moves the specified axis to an absolute position, waits until it 
+        has stopped and reads the position it reached. All of this is sent 
+        as a single command line with a single reply.
+
+        Command: PA;WS;TP
+        
+        Parameters
+        ----------
+        axis : int
+            Axis number (1 to MAX AXES).
+        position : float
+            Desired absolute position in predefined units.
+        settle_ms : int
+            Milliseconds the controller waits after the stop before 
+            reading the position (default: 0).
+        timeout : float
+            Seconds to wait for the move to finish (default: 60). 
+            The axis is stopped when they have passed.
+
+        Returns
+        -------
+        float
+            The position of the axis after the move.
+        
+        Notes
+        -----
+        The serial connection stays locked until the move is done, 
+        other threads using the controller wait for it.
+        """
+        full_command = self.encode_command(f"{axis}PA{position};{axis}WS{settle_ms};{axis}TP")
+        with self.lock:
+            self.write(full_command)
+            # The reply only comes once the axis has stopped
+            reply = self.read_line_before(time.monotonic() + timeout, axis)
+        if reply is None:
+            raise TimeoutError(f"Axis {axis} did not reach {position} within {timeout} s")
+        return float(reply)
+
     def get_position(self, axis):
         """
         Retrieves the current position of the specified axis.
@@ -262,10 +636,32 @@ class ESP300Controller:
 
         Returns
         -------
-        str
+        float
             The current position of the axis.
         """
-        return self.read_response(f"{axis}TP")
+        return self.read_float(f"{axis}TP")
+
+    def get_positions(self, axes):
+        """
+        Retrieves the current positions of several axes 
+        with a single serial exchange.
+
+        Command: TP
+
+        Parameters
+        ----------
+        axes : list of int
+            Axis numbers (1 to MAX AXES).
+
+        Returns
+        -------
+        list of float
+            The current positions of the axes in the same order.
+        """
+        replies = self.query_batch([f"{axis}TP" for axis in axes])
+        if len(replies) < len(axes):
+            raise TimeoutError(f"Only {len(replies)} of {len(axes)} positions were received")
+        return [float(reply) for reply in replies]
 
     def stop_motion(self, axis):
         """
@@ -293,6 +689,36 @@ class ESP300Controller:
         """
         self.send_command(f"{axis}WS")
                 
+    def wait_for_stop_blocking(self, axis, timeout=60):
+        """
+        Waits until the specified axis has stopped, with a single command 
+        line and a single reply instead of repeated status queries.
+
+        Command: WS;MD?
+        
+        Parameters
+        ----------
+        axis : int
+            Axis number (1 to MAX AXES).
+        timeout : float
+            Seconds to wait for the axis to stop (default: 60). 
+            The axis is stopped when they have passed.
+        
+        Notes
+        -----
+        The controller holds back the MD? reply until the motion is done. 
+        The serial connection stays locked until then, other threads 
+        using the controller wait for it.
+        """
+        full_command = self.encode_command(f"{axis}WS;{axis}MD?")
+        with self.lock:
+            self.write(full_command)
+            reply = self.read_line_before(time.monotonic() + timeout, axis)
+        if reply is None:
+            raise TimeoutError(f"Axis {axis} did not stop within {timeout} s")
+        if reply.strip() != b"1":
+            raise ValueError(f"Unexpected reply to {axis}MD?: {reply!r}")
+        
     def get_motion_status(self, axis):
         """
         Retrieves the motion status of the specified axis.
@@ -315,7 +741,67 @@ class ESP300Controller:
         and what its manual specifies. This is so that True corresponds to 
         moving and False corresponds to movement done.
         """
-        return not bool(int(self.read_response(f"{axis}MD?")))
+        return not self.read_bool(f"{axis}MD?")
+    
+
+    def get_motion_statuses(self, axes):
+        """
+        Retrieves the motion status of several axes 
+        with a single serial exchange.
+
+        Command: MD?
+        
+        Parameters
+        ----------
+        axes : list of int
+            Axis numbers (1 to MAX AXES).
+        
+        Returns
+        -------
+        list of bool
+            Whether each axis is still moving, in the same order. 
+            Inverted like get_motion_status.
+        """
+        replies = self.query_batch([f"{axis}MD?" for axis in axes])
+        if len(replies) < len(axes):
+            raise TimeoutError(f"Only {len(replies)} of {len(axes)} motion states were received")
+        moving = []
+        for axis, reply in zip(axes, replies):
+            # Same strict check as read_bool, an error text is not a motion state
+            if reply == "1":
+                moving.append(False)
+            elif reply == "0":
+                moving.append(True)
+            else:
+                raise ValueError(f"Unexpected reply to {axis}MD?: {reply!r}")
+        return moving
+    
+    def wait_for_motion_done(self, axis, initial=0.002, cap=0.05):
+        """
+        Waits until the specified axis has stopped by polling its motion 
+        status. The polls start fast, so that short moves are detected 
+        early, and slow down for long moves.
+
+        Command: MD?
+        
+        Parameters
+        ----------
+        axis : int
+            Axis number (1 to MAX AXES).
+        initial : float
+            Seconds between the first two polls (default: 0.002).
+        cap : float
+            Maximum seconds between two polls (default: 0.05).
+        
+        Notes
+        -----
+        Unlike wait_for_stop this blocks the calling thread, not the 
+        controller, which keeps accepting commands from other threads.
+        """
+        delay = initial
+        while self.get_motion_status(axis):
+            time.sleep(delay)
+            delay = min(1.5 * delay, cap)
     
 
     def set_velocity(self, axis, velocity):
@@ -346,10 +832,10 @@ class ESP300Controller:
         
         Returns
         -------
-        str
+        float
             The current velocity of the axis.
         """
-        return self.read_response(f"{axis}VA?")
+        return self.read_float(f"{axis}VA?")
 
     def get_velocity_current(self, axis):
         """
@@ -364,10 +850,10 @@ class ESP300Controller:
         
         Returns
         -------
-        str
+        float
             The current velocity of the axis.
         """
-        return self.read_response(f"{axis}TV")
+        return self.read_float(f"{axis}TV")
     
     def set_acceleration(self, axis, acceleration):
         """
@@ -397,10 +883,10 @@ class ESP300Controller:
 
         Returns
         -------
-        str
+        float
             The current acceleration of the axis.
         """
-        return self.read_response(f"{axis}AC?")
+        return self.read_float(f"{axis}AC?")
 
 
     def reset_controller(self):
@@ -410,10 +896,37 @@ class ESP300Controller:
         Command: RS
         """
         self.send_command("RS")
+        self.clear_cache()
+
+    def clear_cache(self):
+        """
+        Forgets the stored replies of get_id and get_homing_mode, 
+        e.g. after the controller was configured by other software.
+        """
+        self.id_cache.clear()
+        self.homing_mode_cache.clear()
 
     
     def close(self):
         """
         Closes the serial connection to the controller.
+        A read waiting in another thread returns immediately.
         """
+        try:
+            self.serial.cancel_read()
+        except Exception:  # Not supported by every pyserial version and backend
+            pass
         self.serial.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def __del__(self):
+        # Releases the port of a controller that was never closed, the port may not exist if __init__ failed
+        try:
+            self.serial.close()
+        except Exception:
+            pass